@@ -1,121 +1,150 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-import subprocess
+from pydantic import BaseModel, Field
+import asyncio
 import os
-import time
-from typing import Dict
+from typing import List
+from pipeline import DEFAULT_RENDITIONS, RENDITIONS, build_command, output_urls
+from supervisor import Supervisor
+from transcode_cache import TranscodeCache
 
-app = FastAPI()
+# Надзор за запущенными процессами ffmpeg: вывод вычитывается, упавшие перезапускаются
+supervisor = Supervisor()
 
-# Хранилище запущенных процессов ffmpeg и batch
-processes: Dict[str, subprocess.Popen] = {}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        yield
+    finally:
+        await supervisor.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Кэш заранее закодированных версий: каталог и предельный размер
+TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".transcode_cache"))
+TRANSCODE_CACHE_MAX_BYTES = int(os.getenv("TRANSCODE_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+transcode_cache = TranscodeCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES)
+
+# Базовый RTMP-адрес зашит в коде
+RTMP_BASE = "rtmp://localhost:1935/live"
 
 class PublishRequest(BaseModel):
     video_path: str             # Локальный путь к видеофайлу
     stream_key: str = "drone"  # Ключ потока (часть URL)
+    renditions: List[str] = Field(default_factory=lambda: list(DEFAULT_RENDITIONS))  # версии из RENDITIONS
+    use_cache: bool = True       # публиковать перекодированные версии из кэша через -c copy
+    wait_for_cache: bool = False  # True — ждать кодирования в кэш перед запуском (долго для первого запуска файла)
 
 @app.post("/stream/start")
 async def start_stream(req: PublishRequest):
     """
-    Запускает два процесса:
-    1) FFmpeg читает видео и публикует его в RTMP-сервер (loop).
-    2) stream.bat выполняет аналогичную публикацию (для совместимости).
+    Запускает один процесс ffmpeg, который читает видео по кругу и публикует
+    все запрошенные версии потока (renditions) в RTMP-сервер:
+    - source: исходный поток без перекодирования → live/{key}
+    - ll: 15 fps H.264 с минимальной задержкой → live/{key}_ll
+    - proxy: лёгкая версия 240p → live/{key}_proxy
+    Видео декодируется один раз, сколько бы версий ни публиковалось.
+    Перекодированные версии берутся из кэша (кодируются один раз на файл
+    и профиль), поэтому повторные запуски не тратят CPU на кодирование.
+    Если готовой версии ещё нет, первый запуск кодирует её на лету, а кэш
+    заполняется в фоне и используется со следующего запуска.
 
     RTMP URL задан в коде.
     """
     key = req.stream_key
-    video = req.video_path
-    # Базовый RTMP-адрес зашит в коде
-    target = f"rtmp://localhost:1935/live/{key}"
 
-    # 1. Проверка дублирования
-    if key in processes and processes[key].poll() is None:
+    # 1. Проверка дублирования: ключ занят до конца запуска, одновременные запросы получают 409
+    if not supervisor.reserve(key):
         raise HTTPException(409, f"Stream '{key}' уже запущен")
+    try:
+        return await publish(req)
+    finally:
+        supervisor.release(key)
+
+async def publish(req: PublishRequest) -> dict:
+    """Подготовка версий и запуск публикатора; ключ потока уже занят в supervisor"""
+    key = req.stream_key
+    video = req.video_path
 
-    # 2. Проверка существования файла
+    # 2. Проверка существования файла и набора версий
     if not os.path.isfile(video):
         raise HTTPException(400, f"Видео не найдено: {video}")
-
-    # 3. Запуск FFmpeg для бесконечного loop
-    ffmpeg_cmd = [
-        "ffmpeg", "-re", "-stream_loop", "-1",
-        "-i", video, "-c", "copy", "-f", "flv", target
-    ]
+    unknown = [name for name in req.renditions if name not in RENDITIONS]
+    if unknown or not req.renditions:
+        raise HTTPException(400, f"Неизвестные версии: {unknown}; доступны: {list(RENDITIONS)}")
+    names = list(dict.fromkeys(req.renditions))
+
+    # 3. Готовые версии из кэша; недостающие кодируются в фоне (с wait_for_cache — ожидание одного общего кодирования)
+    cached = {}
+    if req.use_cache:
+        encoded = [name for name in names if not RENDITIONS[name].passthrough]
+        if req.wait_for_cache:
+            results = await asyncio.gather(
+                *(transcode_cache.get(video, RENDITIONS[name]) for name in encoded),
+                return_exceptions=True,
+            )
+        else:
+            results = [await transcode_cache.lookup(video, RENDITIONS[name]) for name in encoded]
+            for name, path in zip(encoded, results):
+                if path is None:
+                    task = asyncio.ensure_future(transcode_cache.get(video, RENDITIONS[name]))
+                    task.add_done_callback(lambda f: f.cancelled() or f.exception())
+        for name, result in zip(encoded, results):
+            # файл мог быть вытеснен, пока кодировались остальные версии
+            if isinstance(result, str) and os.path.isfile(result):
+                cached[name] = result
+            elif isinstance(result, FileNotFoundError):
+                raise HTTPException(500, "ffmpeg не найден в PATH")
+            # при ошибке кодирования версия кодируется на лету
+
+    # 4. Запуск FFmpeg для бесконечного loop
+    # -progress pipe:1 — метрики fps/bitrate/speed для /stream/status
+    # файлы из кэша закрепляются до остановки потока: ffmpeg открывает их заново при каждом перезапуске
+    ffmpeg_cmd = build_command(video, RTMP_BASE, key, names, cached)
+    transcode_cache.pin(key, cached.values())
     try:
-        proc = subprocess.Popen(
-            ffmpeg_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+        pub = await supervisor.start(key, ffmpeg_cmd)
     except FileNotFoundError:
+        transcode_cache.release(key)
         raise HTTPException(500, "ffmpeg не найден в PATH")
     except Exception as e:
+        transcode_cache.release(key)
         raise HTTPException(500, f"Ошибка запуска ffmpeg: {e}")
 
-    # Короткая задержка и проверка, что процесс не упал сразу
-    time.sleep(0.5)
-    if proc.poll() is not None:
-        err = proc.stderr.read().decode(errors='ignore').strip()
+    # Короткая задержка (без блокировки event loop) и проверка, что процесс не упал сразу
+    await asyncio.sleep(0.5)
+    if not pub.running:
+        await supervisor.stop(key)
+        transcode_cache.release(key)
+        err = "\n".join(pub.stderr_tail).strip()
         raise HTTPException(500, f"ffmpeg завершился сразу: {err or 'без вывода'}")
 
-    processes[key] = proc
-
-    # 4. Запуск дополнительного скрипта stream.bat
-    script_dir = os.path.dirname(__file__)
-    batch_path = os.path.join(script_dir, "stream.bat")
-    if not os.path.isfile(batch_path):
-        proc.terminate()
-        raise HTTPException(500, f"stream.bat не найден: {batch_path}")
-
-    bat_cmd = ["cmd", "/c", batch_path, video, key]
-    try:
-        bat_proc = subprocess.Popen(
-            bat_cmd,
-            cwd=script_dir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-    except Exception as e:
-        proc.terminate()
-        raise HTTPException(500, f"Не удалось запустить stream.bat: {e}")
-    processes[f"{key}_bat"] = bat_proc
-
+    outputs = output_urls(RTMP_BASE, key, names)
     return {
-        "message": f"Stream '{key}' запущен на {target}"
+        "message": f"Stream '{key}' запущен на {outputs[names[0]]}",
+        "outputs": outputs,
+        "cached": sorted(cached),
     }
 
 @app.delete("/stream/stop")
 async def stop_stream(stream_key: str = Query(..., description="Stream key")):
     """
-    Останавливает связанные с stream_key процессы:
-    - основной ffmpeg
-    - вспомогательный batch
+    Останавливает процесс ffmpeg, публикующий все версии stream_key.
     """
-    # Остановка ffmpeg
-    proc = processes.get(stream_key)
-    if not proc or proc.poll() is not None:
+    if not supervisor.is_active(stream_key):
         raise HTTPException(404, f"Stream '{stream_key}' не запущен")
-    proc.terminate()
-    proc.wait(timeout=5)
-    processes.pop(stream_key, None)
-
-    # Остановка batch
-    bat_key = f"{stream_key}_bat"
-    bat_proc = processes.get(bat_key)
-    if bat_proc and bat_proc.poll() is None:
-        bat_proc.terminate()
-        bat_proc.wait(timeout=5)
-        processes.pop(bat_key, None)
+    await supervisor.stop(stream_key)
+    transcode_cache.release(stream_key)
 
     return {"message": f"Stream '{stream_key}' остановлен"}
 
 @app.get("/stream/status")
 async def stream_status(stream_key: str = Query(..., description="Stream key")):
     """
-    Возвращает статус процесса: 'running' или 'stopped'.
+    Возвращает статус процесса ('running', 'restarting', 'failed' или 'stopped')
+    и метрики публикации из ffmpeg -progress: fps, bitrate, speed, потерянные кадры.
     """
-    proc = processes.get(stream_key)
-    return {
-        "stream_key": stream_key,
-        "status": "running" if proc and proc.poll() is None else "stopped"
-    }
+    pub = supervisor.get(stream_key)
+    if pub is None:
+        return {"stream_key": stream_key, "status": "stopped"}
+    return {"stream_key": stream_key, **pub.info()}
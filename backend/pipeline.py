@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+
+class Rendition(BaseModel):
+    """Одна выходная версия потока, публикуется на rtmp://.../live/{key}{suffix}"""
+    suffix: str = ""
+    passthrough: bool = False       # без перекодирования (-c copy)
+    fps: Optional[int] = None
+    height: Optional[int] = None    # высота кадра, ширина подбирается по пропорциям
+    video_bitrate: Optional[str] = None
+    preset: str = "veryfast"
+    tune: Optional[str] = "zerolatency"
+    audio_bitrate: str = "128k"
+
+
+# Набор доступных версий (по умолчанию публикуются source и ll)
+RENDITIONS: Dict[str, Rendition] = {
+    "source": Rendition(passthrough=True),
+    # то, что раньше делал stream.bat: 15 fps, libx264 veryfast + zerolatency
+    "ll": Rendition(suffix="_ll", fps=15),
+    "proxy": Rendition(suffix="_proxy", fps=10, height=240, video_bitrate="300k", audio_bitrate="64k"),
+}
+DEFAULT_RENDITIONS = ["source", "ll"]
+
+
+def video_filters(r: Rendition) -> str:
+    filters = []
+    if r.fps:
+        filters.append(f"fps={r.fps}")
+    if r.height:
+        filters.append(f"scale=-2:{r.height}")
+    return ",".join(filters) or "null"
+
+
+def encode_args(r: Rendition) -> List[str]:
+    """Параметры кодирования видео и аудио для версии с перекодированием"""
+    args = ["-c:v", "libx264", "-preset", r.preset]
+    if r.tune:
+        args += ["-tune", r.tune]
+    if r.video_bitrate:
+        args += ["-b:v", r.video_bitrate, "-maxrate", r.video_bitrate, "-bufsize", r.video_bitrate]
+    if r.fps:
+        # ключевой кадр раз в 2 секунды — быстрый старт у зрителей
+        args += ["-g", str(r.fps * 2)]
+    args += ["-c:a", "aac", "-ar", "44100", "-b:a", r.audio_bitrate]
+    return args
+
+
+def build_command(
+    video: str,
+    rtmp_base: str,
+    key: str,
+    names: List[str],
+    cached: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    """
+    Одна команда ffmpeg на все версии потока: видео декодируется один раз,
+    filter_complex split раздаёт кадры версиям с перекодированием,
+    passthrough-версии берут исходный поток через -c copy.
+    Версии, для которых в cached уже есть заранее закодированный файл,
+    публикуются из него через -c copy, без кодирования вообще.
+    """
+    cached = cached or {}
+    renditions = [(name, RENDITIONS[name]) for name in names]
+    encoded = [(name, r) for name, r in renditions if not r.passthrough and name not in cached]
+
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "warning", "-nostats", "-progress", "pipe:1"]
+    inputs: Dict[str, int] = {}
+    for name, r in renditions:
+        path = cached.get(name, video) if not r.passthrough else video
+        if path not in inputs:
+            inputs[path] = len(inputs)
+            cmd += ["-re", "-stream_loop", "-1", "-i", path]
+
+    labels: Dict[str, str] = {}
+    if encoded:
+        src = inputs[video]
+        chains = []
+        if len(encoded) > 1:
+            chains.append(f"[{src}:v]split=%d%s" % (len(encoded), "".join(f"[s{i}]" for i in range(len(encoded)))))
+        for i, (name, r) in enumerate(encoded):
+            label = f"[s{i}]" if len(encoded) > 1 else f"[{src}:v]"
+            chains.append(f"{label}{video_filters(r)}[v{i}]")
+            labels[name] = f"[v{i}]"
+        cmd += ["-filter_complex", ";".join(chains)]
+
+    for name, r in renditions:
+        url = f"{rtmp_base}/{key}{r.suffix}"
+        if name in labels:
+            cmd += ["-map", labels[name], "-map", f"{inputs[video]}:a?", *encode_args(r)]
+        else:
+            idx = inputs[video if r.passthrough else cached[name]]
+            cmd += ["-map", f"{idx}:v", "-map", f"{idx}:a?", "-c", "copy"]
+        cmd += ["-f", "flv", url]
+    return cmd
+
+
+def output_urls(rtmp_base: str, key: str, names: List[str]) -> Dict[str, str]:
+    return {name: f"{rtmp_base}/{key}{RENDITIONS[name].suffix}" for name in names}
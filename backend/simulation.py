@@ -1,55 +1,456 @@
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-from typing import Dict
-import subprocess
-
-app = FastAPI(title="Drone Stream Simulator")
-
-# храним процессы по ключу стрима
-processes: Dict[str, subprocess.Popen] = {}
-
-class StreamRequest(BaseModel):
-    video_path: str
-    stream_key: str = "drone"
-    rtmp_url: str = "rtmp://localhost/live"
-
-@app.post("/stream/start")
-async def start_stream(req: StreamRequest):
-    key = req.stream_key
-    if key in processes and processes[key].poll() is None:
-        raise HTTPException(status_code=409, detail=f"Stream '{key}' уже запущен")
-    cmd = [
-        "ffmpeg",
-        "-re",                  # real-time эмуляция
-        "-stream_loop", "-1",   # зациклить
-        "-i", req.video_path,
-        "-c", "copy",
-        "-f", "flv",
-        f"{req.rtmp_url}/{key}"
-    ]
-    try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="ffmpeg не найден в PATH")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    processes[key] = proc
-    return {"message": f"Stream '{key}' запущен на {req.rtmp_url}/{key}"}
-
-@app.post("/stream/stop")
-async def stop_stream(stream_key: str = Query(..., description="ключ потока")):
-    proc = processes.get(stream_key)
-    if not proc or proc.poll() is not None:
-        raise HTTPException(status_code=404, detail=f"Stream '{stream_key}' не запущен")
-    proc.terminate()
-    proc.wait(timeout=5)
-    processes.pop(stream_key, None)
-    return {"message": f"Stream '{stream_key}' остановлен"}
-
-@app.get("/stream/status")
-async def stream_status(stream_key: str = Query(..., description="ключ потока")):
-    proc = processes.get(stream_key)
-    if proc and proc.poll() is None:
-        return {"stream_key": stream_key, "status": "running"}
-    return {"stream_key": stream_key, "status": "stopped"}
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import time
+import httpx
+from supervisor import Publisher, Supervisor
+
+logger = logging.getLogger(__name__)
+
+# процессы-публикаторы по ключу стрима (и ручные, и из нагрузочного теста)
+supervisor = Supervisor()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        yield
+    finally:
+        if load_run is not None:
+            await load_run.cancel()
+        await supervisor.close()
+
+app = FastAPI(title="Drone Stream Simulator", lifespan=lifespan)
+
+class StreamRequest(BaseModel):
+    video_path: str
+    stream_key: str = "drone"
+    rtmp_url: str = "rtmp://localhost/live"
+
+@app.post("/stream/start")
+async def start_stream(req: StreamRequest):
+    key = req.stream_key
+    if not supervisor.reserve(key):
+        raise HTTPException(status_code=409, detail=f"Stream '{key}' уже запущен")
+    cmd = [
+        "ffmpeg",
+        "-nostats", "-progress", "pipe:1",
+        "-re",                  # real-time эмуляция
+        "-stream_loop", "-1",   # зациклить
+        "-i", req.video_path,
+        "-c", "copy",
+        "-f", "flv",
+        f"{req.rtmp_url}/{key}"
+    ]
+    try:
+        await supervisor.start(key, cmd)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="ffmpeg не найден в PATH")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        supervisor.release(key)
+
+    return {"message": f"Stream '{key}' запущен на {req.rtmp_url}/{key}"}
+
+@app.post("/stream/stop")
+async def stop_stream(stream_key: str = Query(..., description="ключ потока")):
+    if not supervisor.is_active(stream_key):
+        raise HTTPException(status_code=404, detail=f"Stream '{stream_key}' не запущен")
+    await supervisor.stop(stream_key)
+    return {"message": f"Stream '{stream_key}' остановлен"}
+
+@app.get("/stream/status")
+async def stream_status(stream_key: str = Query(..., description="ключ потока")):
+    pub = supervisor.get(stream_key)
+    if pub is None:
+        return {"stream_key": stream_key, "status": "stopped"}
+    return {"stream_key": stream_key, **pub.info()}
+
+
+# ---------------------------------------------------------------------------
+# Нагрузочный генератор: N синтетических публикаторов (lavfi testsrc2 + sine)
+# ---------------------------------------------------------------------------
+
+class LoadTestConfig(BaseModel):
+    """Параметры сценария нагрузки"""
+    scenario: Literal["ramp", "churn", "soak"] = "ramp"
+    count: int = Field(10, ge=1, le=1000)          # число одновременных публикаторов
+    width: int = 1280
+    height: int = 720
+    fps: int = 30
+    video_bitrate: str = "2000k"
+    preset: str = "ultrafast"
+    stagger: float = Field(1.0, ge=0)              # пауза между запусками публикаторов, с
+    duration: float = Field(60.0, gt=0)            # удержание нагрузки после запуска всех, с
+    churn_interval: float = Field(5.0, gt=0)       # churn: как часто перезапускать случайный публикатор, с
+    soak_window: float = Field(60.0, gt=0)         # soak: длина окна сводки для отслеживания дрейфа, с
+    sample_interval: float = Field(1.0, gt=0)      # период снятия метрик, с
+    pin_cpus: bool = True                          # раскладывать процессы по ядрам (taskset)
+    rtmp_url: str = "rtmp://localhost/live"
+    key_prefix: str = "load"
+    converter_url: Optional[str] = None            # если задан — потоки регистрируются в конвертере и ждём RTSP
+    report_dir: str = "loadtest_reports"
+
+
+def synthetic_command(cfg: LoadTestConfig, key: str, cpu: Optional[int]) -> List[str]:
+    """Команда ffmpeg для синтетического потока; при наличии taskset процесс закрепляется за ядром"""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "warning",
+        "-nostats", "-progress", "pipe:1", "-stats_period", "0.2",
+        "-re",
+        "-f", "lavfi", "-i", f"testsrc2=size={cfg.width}x{cfg.height}:rate={cfg.fps}",
+        "-f", "lavfi", "-i", "sine=frequency=1000:sample_rate=44100",
+        "-c:v", "libx264", "-preset", cfg.preset, "-tune", "zerolatency",
+        "-b:v", cfg.video_bitrate, "-maxrate", cfg.video_bitrate, "-bufsize", cfg.video_bitrate,
+        "-g", str(cfg.fps * 2), "-threads", "1",
+        "-c:a", "aac", "-b:a", "64k",
+        "-f", "flv", f"{cfg.rtmp_url}/{key}",
+    ]
+    if cpu is not None:
+        cmd = ["taskset", "-c", str(cpu)] + cmd
+    return cmd
+
+
+class PublisherStats:
+    """Метрики одного публикатора за прогон"""
+
+    def __init__(self, key: str, cpu: Optional[int]):
+        self.key = key
+        self.cpu = cpu
+        self.launched_at = time.monotonic()
+        self.stopped_at: Optional[float] = None
+        self.startup_seconds: Optional[float] = None   # до первого отправленного кадра
+        self.rtsp_ready_seconds: Optional[float] = None  # до готовности пути в MediaMTX
+        self.fps: List[float] = []
+        self.speed: List[float] = []
+        self.drop_frames = 0
+        self.restarts = 0
+        self.register_error: Optional[str] = None  # ошибка регистрации пути в конвертере
+        self._prev: Optional[tuple] = None  # (время блока -progress, frame, out_time_us) прошлого замера
+
+    def observe(self, metrics: dict, at: float) -> Optional[float]:
+        """
+        Замер за интервал с прошлого блока -progress. fps и speed из ffmpeg —
+        средние с начала процесса и почти не меняются, когда кадры начинают
+        теряться в середине прогона, поэтому fps считается по приросту frame,
+        а speed — по приросту out_time за то же время. Возвращает fps интервала.
+        """
+        frame, out_us = metrics.get("frame"), metrics.get("out_time_us")
+        prev = self._prev
+        if prev is not None and at <= prev[0]:
+            return None  # нового блока с прошлого замера нет
+        self._prev = (at, frame, out_us)
+        if prev is None or frame is None or prev[1] is None or frame < prev[1]:
+            return None  # первый замер или перезапуск процесса (счётчики с нуля)
+        dt = at - prev[0]
+        fps = round((frame - prev[1]) / dt, 2)
+        self.fps.append(fps)
+        if out_us is not None and prev[2] is not None and out_us >= prev[2]:
+            self.speed.append(round((out_us - prev[2]) / 1e6 / dt, 3))
+        return fps
+
+    def summary(self, target_fps: int) -> dict:
+        fps = self.fps
+        return {
+            "stream_key": self.key,
+            "cpu": self.cpu,
+            "startup_seconds": self.startup_seconds,
+            "rtsp_ready_seconds": self.rtsp_ready_seconds,
+            "samples": len(fps),
+            "avg_fps": round(statistics.fmean(fps), 2) if fps else None,
+            "min_fps": min(fps) if fps else None,
+            "avg_speed": round(statistics.fmean(self.speed), 3) if self.speed else None,
+            # доля замеров, где публикатор держал не меньше 95% целевого fps
+            "fps_ok_ratio": round(sum(f >= 0.95 * target_fps for f in fps) / len(fps), 3) if fps else None,
+            "drop_frames": self.drop_frames,
+            "restarts": self.restarts,
+            "register_error": self.register_error,
+        }
+
+
+class LoadRun:
+    """
+    Один прогон сценария: ramp — разгон и удержание, churn — перезапуск
+    случайных публикаторов, soak — длительное удержание со сводкой по окнам
+    и дрейфом fps/speed относительно начала.
+    """
+
+    def __init__(self, cfg: LoadTestConfig):
+        self.cfg = cfg
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.started = time.monotonic()
+        self.state = "running"
+        self.error: Optional[str] = None
+        self.active: Dict[str, Publisher] = {}
+        self.stats: Dict[str, PublisherStats] = {}
+        self.timeline: List[dict] = []
+        self.windows: List[dict] = []  # soak: сводки по окнам soak_window
+        self.report_files: List[str] = []
+        self._seq = 0
+        self._task: Optional[asyncio.Task] = None
+        taskset = shutil.which("taskset") if cfg.pin_cpus else None
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        self._cpus = cpus if taskset and cpus else []
+        self._http = httpx.AsyncClient(timeout=5) if cfg.converter_url else None
+
+    def start(self):
+        self._task = asyncio.create_task(self._main())
+
+    async def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def wait(self):
+        await self._task
+
+    async def _launch(self):
+        key = f"{self.cfg.key_prefix}{self._seq:04d}"
+        cpu = self._cpus[self._seq % len(self._cpus)] if self._cpus else None
+        self._seq += 1
+        stats = PublisherStats(key, cpu)
+        self.stats[key] = stats
+        self.active[key] = await supervisor.start(key, synthetic_command(self.cfg, key, cpu))
+        if self._http is not None:
+            try:
+                resp = await self._http.post(
+                    f"{self.cfg.converter_url}/stream/convert",
+                    json={"rtmp_source": f"{self.cfg.rtmp_url}/{key}"},
+                )
+                if resp.status_code != 200:
+                    stats.register_error = f"{resp.status_code} {resp.text}"
+            except httpx.HTTPError as e:
+                stats.register_error = str(e) or type(e).__name__
+            if stats.register_error is not None:
+                logger.warning(f"Load test: register {key} failed: {stats.register_error}")
+
+    async def _stop(self, key: str):
+        pub = self.active.pop(key, None)
+        st = self.stats[key]
+        if pub is not None:
+            self._record_startup(st, pub)
+        st.stopped_at = time.monotonic()
+        await supervisor.stop(key)
+
+    @staticmethod
+    def _record_startup(st: PublisherStats, pub: Publisher):
+        # момент первого кадра фиксируется в цикле чтения -progress, а не с точностью sample_interval
+        if st.startup_seconds is None and pub.first_frame_at is not None:
+            st.startup_seconds = round(pub.first_frame_at - st.launched_at, 3)
+
+    async def _ramp_up(self):
+        while len(self.active) < self.cfg.count:
+            await self._launch()
+            if self.cfg.stagger:
+                await asyncio.sleep(self.cfg.stagger)
+
+    async def _main(self):
+        sampler = asyncio.create_task(self._sample_loop())
+        try:
+            await self._ramp_up()
+            if self.cfg.scenario == "churn":
+                deadline = time.monotonic() + self.cfg.duration
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(self.cfg.churn_interval)
+                    await self._stop(random.choice(list(self.active)))
+                    await self._launch()
+            elif self.cfg.scenario == "soak":
+                await self._soak()
+            else:
+                # ramp: удержание после разгона
+                await asyncio.sleep(self.cfg.duration)
+            self.state = "finished"
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+        finally:
+            sampler.cancel()
+            await asyncio.gather(*(self._stop(k) for k in list(self.active)), return_exceptions=True)
+            if self._http is not None:
+                await self._http.aclose()
+            self.report_files = self.write_report()
+
+    async def _sample_loop(self):
+        while True:
+            await asyncio.sleep(self.cfg.sample_interval)
+            now = time.monotonic()
+            fps_values, speed_values = [], []
+            for key, pub in self.active.items():
+                st = self.stats[key]
+                m = pub.metrics
+                st.restarts = pub.restarts
+                if not m:
+                    continue
+                self._record_startup(st, pub)
+                fps = st.observe(m, pub.progress_at)
+                if fps is not None:
+                    fps_values.append(fps)
+                    if st.speed:
+                        speed_values.append(st.speed[-1])
+                st.drop_frames = m.get("drop_frames") or st.drop_frames
+            if self._http is not None:
+                await self._sample_converter(now)
+            self.timeline.append({
+                "t": round(now - self.started, 2),
+                "active": len(self.active),
+                "avg_fps": round(statistics.fmean(fps_values), 2) if fps_values else None,
+                "min_fps": min(fps_values) if fps_values else None,
+                "below_target": sum(f < 0.95 * self.cfg.fps for f in fps_values),
+                "avg_speed": round(statistics.fmean(speed_values), 3) if speed_values else None,
+            })
+
+    async def _soak(self):
+        """
+        Длительное удержание нагрузки: каждые soak_window секунд замеры
+        таймлайна сводятся в окно и сравниваются с первым окном — так видна
+        медленная деградация (утечки, перегрев, фрагментация), которую
+        не покажут короткие ramp и churn.
+        """
+        deadline = time.monotonic() + self.cfg.duration
+        mark, restarts = len(self.timeline), 0
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            await asyncio.sleep(min(self.cfg.soak_window, left))
+            samples = self.timeline[mark:]
+            mark = len(self.timeline)
+            total_restarts = sum(st.restarts for st in self.stats.values())
+            fps = [x["avg_fps"] for x in samples if x["avg_fps"] is not None]
+            speed = [x["avg_speed"] for x in samples if x["avg_speed"] is not None]
+            window = {
+                "t": round(time.monotonic() - self.started, 2),
+                "samples": len(samples),
+                "active": len(self.active),
+                "avg_fps": round(statistics.fmean(fps), 2) if fps else None,
+                "min_fps": min((x["min_fps"] for x in samples if x["min_fps"] is not None), default=None),
+                "below_target_max": max((x["below_target"] for x in samples), default=0),
+                "avg_speed": round(statistics.fmean(speed), 3) if speed else None,
+                "restarts": total_restarts - restarts,
+            }
+            restarts = total_restarts
+            first = next((w for w in self.windows if w["avg_fps"]), None)
+            if first is not None and window["avg_fps"] is not None:
+                window["fps_drift_pct"] = round(100 * (window["avg_fps"] / first["avg_fps"] - 1), 2)
+            self.windows.append(window)
+            logger.info(f"Soak window: {window}")
+
+    def soak_summary(self) -> dict:
+        """Дрейф последнего окна относительно первого и линейный тренд fps/speed (в час)"""
+        summary: Dict[str, object] = {"window_seconds": self.cfg.soak_window, "windows": self.windows}
+        for field in ("avg_fps", "avg_speed"):
+            points = [(w["t"], w[field]) for w in self.windows if w[field] is not None]
+            name = field.split("_", 1)[1]
+            if points and points[0][1]:
+                summary[f"{name}_drift_pct"] = round(100 * (points[-1][1] / points[0][1] - 1), 2)
+            if len(points) >= 2 and points[0][0] != points[-1][0]:
+                slope = statistics.linear_regression([t for t, _ in points], [v for _, v in points]).slope
+                summary[f"{name}_trend_per_hour"] = round(slope * 3600, 3)
+        return summary
+
+    async def _sample_converter(self, now: float):
+        try:
+            resp = await self._http.get(f"{self.cfg.converter_url}/streams")
+            streams = resp.json().get("streams", [])
+        except (httpx.HTTPError, ValueError):
+            return
+        for s in streams:
+            st = self.stats.get(s.get("stream_key"))
+            if st and st.rtsp_ready_seconds is None and s.get("status") == "running":
+                st.rtsp_ready_seconds = round(now - st.launched_at, 3)
+
+    def report(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "state": self.state,
+            "error": self.error,
+            "config": self.cfg.model_dump() if hasattr(self.cfg, "model_dump") else self.cfg.dict(),
+            "elapsed_seconds": round(time.monotonic() - self.started, 2),
+            "active": len(self.active),
+            "publishers": [st.summary(self.cfg.fps) for st in self.stats.values()],
+            "timeline": self.timeline,
+            **({"soak": self.soak_summary()} if self.cfg.scenario == "soak" else {}),
+            "report_files": self.report_files,
+        }
+
+    def write_report(self) -> List[str]:
+        """JSON с полным отчётом и CSV со сводкой по публикаторам"""
+        os.makedirs(self.cfg.report_dir, exist_ok=True)
+        base = os.path.join(self.cfg.report_dir, f"{self.cfg.scenario}-{self.run_id}")
+        report = self.report()
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        rows = report["publishers"]
+        with open(base + ".csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["stream_key"])
+            writer.writeheader()
+            writer.writerows(rows)
+        return [base + ".json", base + ".csv"]
+
+
+load_run: Optional[LoadRun] = None
+
+@app.post("/loadtest")
+async def start_loadtest(cfg: LoadTestConfig):
+    """Запускает сценарий нагрузки в фоне; прогресс и отчёт — GET /loadtest"""
+    global load_run
+    if load_run is not None and load_run.state == "running":
+        raise HTTPException(status_code=409, detail="Нагрузочный тест уже идёт")
+    if shutil.which("ffmpeg") is None:
+        raise HTTPException(status_code=500, detail="ffmpeg не найден в PATH")
+    load_run = LoadRun(cfg)
+    load_run.start()
+    return {"run_id": load_run.run_id, "state": load_run.state}
+
+@app.get("/loadtest")
+async def loadtest_status():
+    if load_run is None:
+        raise HTTPException(status_code=404, detail="Нагрузочный тест не запускался")
+    return load_run.report()
+
+@app.delete("/loadtest")
+async def stop_loadtest():
+    if load_run is None or load_run.state != "running":
+        raise HTTPException(status_code=404, detail="Нагрузочный тест не идёт")
+    await load_run.cancel()
+    return {"run_id": load_run.run_id, "state": load_run.state, "report_files": load_run.report_files}
+
+
+async def run_cli(cfg: LoadTestConfig):
+    run = LoadRun(cfg)
+    run.start()
+    try:
+        await run.wait()
+    finally:
+        await supervisor.close()
+    for p in run.report_files:
+        print(p)
+
+
+if __name__ == "__main__":
+    # python simulation.py --scenario ramp --count 20 --stagger 2 --duration 120
+    parser = argparse.ArgumentParser(description="Нагрузочный тест RTMP/RTSP-стека синтетическими потоками")
+    for name, field in LoadTestConfig.model_fields.items():
+        default = field.default
+        kind = type(default) if default is not None else str
+        if kind is bool:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, action=argparse.BooleanOptionalAction, default=default)
+        else:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=kind, default=default)
+    asyncio.run(run_cli(LoadTestConfig(**vars(parser.parse_args()))))
@@ -0,0 +1,222 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+from typing import Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def parse_progress(block: Dict[str, str]) -> dict:
+    """Переводит блок ffmpeg -progress (key=value) в метрики публикации"""
+
+    def num(key, cast=float, strip=""):
+        value = block.get(key, "").strip()
+        if strip and value.endswith(strip):
+            value = value[: -len(strip)]
+        try:
+            return cast(value)
+        except ValueError:
+            return None
+
+    return {
+        "frame": num("frame", int),
+        "fps": num("fps"),
+        "bitrate_kbps": num("bitrate", strip="kbits/s"),
+        "speed": num("speed", strip="x"),
+        "drop_frames": num("drop_frames", int),
+        "dup_frames": num("dup_frames", int),
+        "total_size": num("total_size", int),
+        "out_time": block.get("out_time"),
+        "out_time_us": num("out_time_us", int),
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+class Publisher:
+    """
+    Один процесс-публикатор под надзором:
+    stdout/stderr постоянно вычитываются (ffmpeg не встанет на полном пайпе),
+    вывод -progress превращается в метрики, а упавший процесс перезапускается
+    с экспоненциальной задержкой.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        progress: bool = True,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 60.0,
+        stable_after: float = 30.0,
+    ):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.progress = progress
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.status = "starting"
+        self.restarts = 0
+        self.last_exit_code: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.metrics: dict = {}
+        self.progress_at: Optional[float] = None  # когда пришёл последний блок -progress (monotonic)
+        self.first_frame_at: Optional[float] = None  # первый блок с frame > 0 (monotonic)
+        self.stderr_tail: Deque[str] = collections.deque(maxlen=50)
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        """Запускает первый процесс (ошибки запуска пробрасываются) и надзор за ним"""
+        await self._spawn()
+        self._task = asyncio.create_task(self._supervise())
+
+    async def stop(self, timeout: float = 5.0):
+        self._stopping = True
+        if self.running:
+            self.proc.terminate()
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+                await self.proc.wait()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.status = "stopped"
+
+    def info(self) -> dict:
+        uptime = time.monotonic() - self.started_at if self.running and self.started_at else None
+        return {
+            "status": self.status,
+            "pid": self.proc.pid if self.running else None,
+            "uptime_seconds": uptime,
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit_code,
+            "metrics": self.metrics,
+            "last_error": list(self.stderr_tail)[-5:],
+        }
+
+    async def _spawn(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            cwd=self.cwd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self.started_at = time.monotonic()
+        self.status = "running"
+        logger.info(f"Publisher {self.name} started (pid {self.proc.pid})")
+
+    async def _supervise(self):
+        backoff = self.backoff_initial
+        while True:
+            await asyncio.gather(self._drain_stdout(), self._drain_stderr())
+            self.last_exit_code = await self.proc.wait()
+            if self._stopping:
+                return
+            runtime = time.monotonic() - self.started_at
+            if runtime >= self.stable_after:
+                backoff = self.backoff_initial
+            self.status = "restarting"
+            logger.warning(
+                f"Publisher {self.name} exited with {self.last_exit_code} after {runtime:.1f}s, "
+                f"restarting in {backoff:.1f}s"
+            )
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+            try:
+                await self._spawn()
+            except OSError as e:
+                self.status = "failed"
+                self.stderr_tail.append(str(e))
+                logger.error(f"Publisher {self.name} restart failed: {e}")
+                return
+            self.restarts += 1
+
+    async def _drain_stdout(self):
+        block: Dict[str, str] = {}
+        async for raw in self.proc.stdout:
+            if not self.progress:
+                continue
+            key, sep, value = raw.decode(errors="ignore").strip().partition("=")
+            if not sep:
+                continue
+            block[key] = value
+            # блок -progress заканчивается строкой progress=continue|end
+            if key == "progress":
+                self.metrics = parse_progress(block)
+                self.progress_at = time.monotonic()
+                if self.first_frame_at is None and (self.metrics["frame"] or 0) > 0:
+                    self.first_frame_at = self.progress_at
+                block = {}
+
+    async def _drain_stderr(self):
+        async for raw in self.proc.stderr:
+            line = raw.decode(errors="ignore").rstrip()
+            if line:
+                self.stderr_tail.append(line)
+
+
+class Supervisor:
+    """
+    Реестр публикаторов по имени.
+    Между проверкой «уже запущен» и регистрацией публикатора есть await
+    (запуск процесса, подготовка файлов), поэтому имя сначала занимается
+    через reserve — одновременные запуски того же имени получают отказ.
+    """
+
+    def __init__(self):
+        self.publishers: Dict[str, Publisher] = {}
+        self._reserved: Set[str] = set()
+
+    def reserve(self, name: str) -> bool:
+        """Занимает имя до окончания запуска; False — поток уже работает или запускается"""
+        if self.is_active(name) or name in self._reserved:
+            return False
+        self._reserved.add(name)
+        return True
+
+    def release(self, name: str):
+        self._reserved.discard(name)
+
+    def get(self, name: str) -> Optional[Publisher]:
+        return self.publishers.get(name)
+
+    def is_active(self, name: str) -> bool:
+        pub = self.publishers.get(name)
+        return pub is not None and pub.status in ("running", "restarting")
+
+    async def start(self, name: str, cmd: List[str], **kwargs) -> Publisher:
+        """Запускает публикатор; имя должно быть занято через reserve (или не использоваться)"""
+        pub = Publisher(name, cmd, **kwargs)
+        # регистрация до первого await: close() остановит и процесс, запускаемый прямо сейчас
+        self.publishers[name] = pub
+        try:
+            await pub.start()
+        except BaseException:
+            if self.publishers.get(name) is pub:
+                del self.publishers[name]
+            raise
+        return pub
+
+    async def stop(self, name: str):
+        pub = self.publishers.pop(name, None)
+        if pub is not None:
+            await pub.stop()
+
+    async def close(self):
+        await asyncio.gather(*(self.stop(name) for name in list(self.publishers)))
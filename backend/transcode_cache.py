@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from pipeline import Rendition, encode_args, video_filters
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# меняется при изменении параметров кодирования, чтобы старые файлы не переиспользовались
+CACHE_VERSION = 1
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def profile_digest(r: Rendition) -> str:
+    data = json.dumps({"v": CACHE_VERSION, **vars(r)}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+class TranscodeCache:
+    """
+    Кэш заранее закодированных версий видео для зацикленной публикации.
+    Ключ — хэш содержимого исходника + хэш профиля кодирования. Каждый
+    исходник кодируется один раз в MP4 с фиксированным GOP (его безопасно
+    крутить через -stream_loop с -c copy); одновременные запросы одного
+    и того же файла/профиля ждут одну задачу кодирования. Размер каталога
+    ограничен max_bytes, вытесняются давно не использованные файлы; файлы,
+    закреплённые работающими публикаторами (pin), не удаляются — ffmpeg
+    открывает их заново при каждом перезапуске.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        # (путь, размер, mtime) → хэш содержимого, чтобы не перечитывать файл при каждом старте
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._jobs = SingleFlight()  # идущие кодирования по пути файла
+        self._pins: Dict[str, Set[str]] = {}  # владелец (ключ потока) → используемые файлы
+        # недописанные *.part от прошлого запуска и превышение лимита
+        self._evict()
+
+    def pin(self, owner: str, paths: Iterable[str]):
+        """Закрепляет файлы за публикатором owner (заменяет прежний набор)"""
+        self._pins[owner] = set(paths)
+
+    def release(self, owner: str):
+        self._pins.pop(owner, None)
+
+    def pinned(self) -> Set[str]:
+        return set().union(*self._pins.values())
+
+    async def _source_digest(self, video: str) -> str:
+        st = os.stat(video)
+        key = (os.path.abspath(video), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = await asyncio.to_thread(file_digest, video)
+            self._digests[key] = digest
+        return digest
+
+    async def path_for(self, video: str, r: Rendition) -> str:
+        digest = await self._source_digest(video)
+        return os.path.join(self.root, f"{digest[:32]}-{profile_digest(r)}.mp4")
+
+    async def lookup(self, video: str, r: Rendition) -> Optional[str]:
+        """Путь к готовому файлу или None; использование обновляет его место в LRU"""
+        path = await self.path_for(video, r)
+        if os.path.isfile(path):
+            os.utime(path)
+            return path
+        return None
+
+    async def get(self, video: str, r: Rendition) -> str:
+        """Готовый файл; если его нет — запускает (или ждёт уже идущее) кодирование"""
+        path = await self.path_for(video, r)
+        if os.path.isfile(path):
+            os.utime(path)
+            return path
+        return await self._jobs.do(path, lambda: self._encode(video, r, path))
+
+    async def _encode(self, video: str, r: Rendition, path: str) -> str:
+        tmp = path + ".part"
+        gop = str((r.fps or 25) * 2)
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-i", video,
+            "-vf", video_filters(r),
+            *encode_args(r),
+            # одинаковый GOP без ключевых кадров по смене сцены: стыки петли всегда на ключевом кадре
+            "-g", gop, "-keyint_min", gop, "-sc_threshold", "0",
+            "-movflags", "+faststart",
+            "-f", "mp4", tmp,
+        ]
+        logger.info(f"Transcoding {video} → {path}")
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        _, err = await proc.communicate()
+        if proc.returncode != 0:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise RuntimeError(f"transcode failed: {err.decode(errors='ignore').strip()}")
+        os.replace(tmp, path)
+        self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: Optional[str] = None):
+        files = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".mp4.part"):
+                # недописанный файл без идущего кодирования (прервано падением или перезапуском)
+                if entry.path[:-len(".part")] not in self._jobs:
+                    logger.info(f"Removing stale transcode cache file {entry.path}")
+                    os.remove(entry.path)
+            elif entry.name.endswith(".mp4"):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        pinned = self.pinned()
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep or path in pinned:
+                continue
+            logger.info(f"Evicting transcode cache entry {path}")
+            os.remove(path)
+            total -= size
@@ -2,6 +2,7 @@ import React, { useEffect, useState, useRef } from 'react';
 import Header from './components/Header';
 
 const LOGS_API = 'http://localhost:8001/logs';
+const MAX_LINES = 200;
 
 function getLogColor(line) {
   if (/error|exception|fail|traceback/i.test(line)) return '#ef4444'; // красный
@@ -27,25 +28,29 @@ function LogPage() {
     return el.scrollHeight - el.scrollTop - el.clientHeight < 40; // 40px tolerance
   };
 
-  const fetchLogs = async () => {
-    try {
+  useEffect(() => {
+    // follow-режим: сервер сам присылает последние строки, а затем новые по мере появления
+    const source = new EventSource(`${LOGS_API}?follow=true&lines=${MAX_LINES}`);
+    source.addEventListener('log', e => {
       // Сохраняем, был ли пользователь внизу до обновления
       userWasAtBottom.current = isUserAtBottom();
-      const res = await fetch(LOGS_API);
-      const data = await res.json();
-      setLogs(data.logs || []);
+      const line = JSON.parse(e.data);
+      setLogs(prev => [...prev.slice(-(MAX_LINES - 1)), line]);
       setLoading(false);
-    } catch (e) {
-      setError('Ошибка загрузки логов');
+    });
+    source.onopen = () => {
+      // после переподключения сервер заново пришлёт хвост лога
+      setLogs([]);
+      setError(null);
       setLoading(false);
-    }
-  };
-
-  useEffect(() => {
-    let intervalId;
-    fetchLogs();
-    intervalId = setInterval(fetchLogs, 3000);
-    return () => clearInterval(intervalId);
+    };
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        setError('Ошибка загрузки логов');
+        setLoading(false);
+      }
+    };
+    return () => source.close();
   }, []);
 
   // Автоскролл только если пользователь был внизу до обновления
@@ -100,21 +100,59 @@ function MainPage() {
   const [sortOrder, setSortOrder] = useState('onlineFirst'); // onlineFirst | offlineFirst | alpha | viewers | startedNew | startedOld | bytesReceived | bytesReceivedMin | bytesSent | bytesSentMin
 
   useEffect(() => {
-    let intervalId;
-    const fetchStreams = async () => {
+    // Состояние потоков приходит push-событиями: сначала снимок, затем только изменения
+    const source = new EventSource('http://localhost:8001/streams/events');
+    const patch = (key, fields) => setStreams(prev => prev.map(s => (s.stream_key === key ? { ...s, ...fields } : s)));
+
+    source.addEventListener('snapshot', e => {
+      setStreams(JSON.parse(e.data).streams || []);
+      setError(null);
+      setLoading(false);
+    });
+    source.addEventListener('added', e => {
+      const entry = JSON.parse(e.data);
+      setStreams(prev => [...prev.filter(s => s.stream_key !== entry.stream_key), entry]);
+    });
+    source.addEventListener('removed', e => {
+      const { stream_key } = JSON.parse(e.data);
+      setStreams(prev => prev.filter(s => s.stream_key !== stream_key));
+    });
+    source.addEventListener('status', e => {
+      const { stream_key, ...fields } = JSON.parse(e.data);
+      patch(stream_key, fields);
+    });
+    source.addEventListener('readers', e => {
+      const { stream_key, ...fields } = JSON.parse(e.data);
+      patch(stream_key, fields);
+    });
+    source.onerror = () => {
+      // EventSource переподключается сам и получит свежий снимок
+      if (source.readyState === EventSource.CLOSED) {
+        setError('Error loading streams');
+        setLoading(false);
+      }
+    };
+
+    // Счётчики байт в события не входят — изредка обновляем их из /streams
+    const refreshCounters = async () => {
       try {
         const response = await fetch('http://localhost:8001/streams');
         const data = await response.json();
-        setStreams(data.streams || []);
-        setLoading(false);
+        const byKey = new Map((data.streams || []).map(s => [s.stream_key, s]));
+        setStreams(prev => prev.map(s => {
+          const fresh = byKey.get(s.stream_key);
+          return fresh ? { ...s, bytes_received: fresh.bytes_received, bytes_sent: fresh.bytes_sent } : s;
+        }));
       } catch (err) {
-        setError('Error loading streams');
-        setLoading(false);
+        // ошибки сети покажет EventSource
       }
     };
-    fetchStreams();
-    intervalId = setInterval(fetchStreams, 3000);
-    return () => clearInterval(intervalId);
+    const intervalId = setInterval(refreshCounters, 15000);
+
+    return () => {
+      clearInterval(intervalId);
+      source.close();
+    };
   }, []);
 
   // Фильтрация по кнопкам
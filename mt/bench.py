@@ -0,0 +1,243 @@
+"""
+Бенчмарк API конвертера без настоящего MediaMTX.
+
+Конвертер и заглушки MediaMTX (fake_mediamtx.py, по одной на узел пула)
+работают в одном процессе: запросы идут через httpx.ASGITransport, сеть не
+участвует. Каждый сценарий
+гоняет один эндпоинт с заданной параллельностью и выдаёт пропускную
+способность и p50/p95/p99. Результат можно сохранить как базовую линию
+и сравнивать с ней следующие прогоны (код выхода 1 при регрессии).
+
+    python bench.py --paths 500 --latency 0.002 --save bench_baseline.json
+    python bench.py --paths 500 --latency 0.002 --compare bench_baseline.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# лог конвертера во время бенчмарка пишется во временный файл, а не в рабочий converter.log
+os.environ.setdefault("CONVERTER_LOG", os.path.join(tempfile.mkdtemp(prefix="converter-bench-"), "converter.log"))
+
+import converter  # noqa: E402
+from fake_mediamtx import FakeMediaMTX  # noqa: E402
+from mtx_pool import MediaMTXPool, NodeSpec  # noqa: E402
+
+# запрос сценария: (метод, путь, тело, заголовки)
+RequestSpec = Tuple[str, str, Optional[dict], Optional[dict]]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга по отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def scenarios(paths: int, etag: str) -> Dict[str, Tuple[Callable[[int], RequestSpec], Tuple[int, ...]]]:
+    """Сценарии: имя → (генератор запроса по номеру, ожидаемые статусы)"""
+    run = f"{int(time.time())}{random.randint(0, 999):03d}"
+
+    def stream_key(_):
+        return f"bench{random.randrange(max(paths, 1)):04d}"
+
+    return {
+        "streams": (lambda i: ("GET", "/streams", None, None), (200,)),
+        "streams_etag": (lambda i: ("GET", "/streams", None, {"If-None-Match": etag}), (304,)),
+        "stream_info": (lambda i: ("GET", f"/streams/{stream_key(i)}", None, None), (200,)),
+        "stream_convert": (
+            lambda i: ("POST", "/stream/convert", {"rtmp_source": f"rtmp://localhost/live/conv{run}-{i}"}, None),
+            (200,),
+        ),
+        "logs": (lambda i: ("GET", "/logs?lines=200", None, None), (200,)),
+        "logs_filtered": (lambda i: ("GET", "/logs?lines=100&level=WARNING", None, None), (200,)),
+        "health": (lambda i: ("GET", "/health", None, None), (200,)),
+        "metrics": (lambda i: ("GET", "/metrics", None, None), (200,)),
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    make_request: Callable[[int], RequestSpec],
+    expected: Tuple[int, ...],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> dict:
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def one(i: int, record: bool):
+        method, path, body, headers = make_request(i)
+        t0 = time.perf_counter()
+        try:
+            resp = await client.request(method, path, json=body, headers=headers)
+            status = resp.status_code
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - t0
+        if not record:
+            return
+        if status in expected:
+            latencies.append(elapsed)
+        else:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+
+    async def worker(total: int, record: bool):
+        while next(counter) < total:
+            await one(random.getrandbits(32), record)
+
+    await asyncio.gather(*(worker(warmup, False) for _ in range(concurrency)))
+    counter = itertools.count()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(requests, True) for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Регрессии относительно базовой линии: падение rps или рост p95 больше чем на tolerance"""
+    problems = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if base["rps"] and cur["rps"] < base["rps"] * (1 - tolerance):
+            problems.append(f"{name}: rps {cur['rps']} < {base['rps']} (baseline)")
+        if base["p95_ms"] and cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {cur['p95_ms']} ms > {base['p95_ms']} ms (baseline)")
+        if cur["errors"] and not base.get("errors"):
+            problems.append(f"{name}: errors {cur['errors']}")
+    return problems
+
+
+def print_table(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None):
+    header = f"{'scenario':<16}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        errors = sum(r["errors"].values())
+        line = f"{name:<16}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}{errors:>8}"
+        base = (baseline or {}).get(name)
+        if base and base["rps"]:
+            line += f"   rps {100 * (r['rps'] / base['rps'] - 1):+.1f}%, p95 {r['p95_ms'] - base['p95_ms']:+.3f} ms"
+        print(line)
+
+
+async def main(args) -> int:
+    # пути делятся между узлами; каждый узел — своя заглушка за своим клиентом
+    fakes = []
+    per_node = -(-args.paths // args.nodes)
+    for i in range(args.nodes):
+        fakes.append(FakeMediaMTX(
+            paths=max(0, min(per_node, args.paths - i * per_node)),
+            readers=args.readers,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            seed=args.seed + i,
+            first=i * per_node,
+        ))
+    random.seed(args.seed)
+    nodes = [
+        converter.make_node(
+            NodeSpec(f"fake{i}", f"http://fake{i}:9997", f"rtsp://fake{i}:8554", f"http://fake{i}:9998"),
+            transport=httpx.ASGITransport(app=fake.create_app()),
+        )
+        for i, fake in enumerate(fakes)
+    ]
+    converter.mtx_pool = MediaMTXPool(
+        nodes,
+        placement=args.placement,
+        health_interval=converter.MTX_HEALTH_INTERVAL,
+        down_after=converter.MTX_DOWN_AFTER,
+        page_size=converter.PATHS_PAGE_SIZE,
+    )
+    # вывод лога в консоль заглушает таблицу результатов; запись в файл (её читает /logs) остаётся
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if type(handler) is logging.StreamHandler:
+            root.removeHandler(handler)
+
+    results: Dict[str, dict] = {}
+    async with converter.lifespan(converter.app):
+        transport = httpx.ASGITransport(app=converter.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://converter", timeout=30) as client:
+            etag = (await client.get("/streams")).headers.get("etag", "")
+            available = scenarios(args.paths, etag)
+            names = args.scenario or list(available)
+            for name in names:
+                make_request, expected = available[name]
+                results[name] = await run_scenario(
+                    client, make_request, expected, args.requests, args.concurrency, args.warmup
+                )
+                print(f"{name}: {results[name]['rps']} rps", file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        "python": sys.version.split()[0],
+        "mediamtx_calls": [fake.calls for fake in fakes],
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"saved {args.save}")
+    if baseline is not None:
+        problems = compare(results, baseline, args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк API конвертера на заглушке MediaMTX")
+    parser.add_argument("--scenario", action="append", choices=list(scenarios(0, "")),
+                        help="сценарий (можно несколько раз); по умолчанию все")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--paths", type=int, default=200, help="число путей в заглушке MediaMTX")
+    parser.add_argument("--readers", type=int, default=3, help="читателей на путь")
+    parser.add_argument("--nodes", type=int, default=1, help="число узлов MediaMTX (заглушек)")
+    parser.add_argument("--placement", choices=["hash", "least-load"], default="hash")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа MediaMTX, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов MediaMTX с ошибкой 503")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="сохранить результаты (базовую линию) в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённой базовой линией")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение rps/p95, доля")
+    sys.exit(asyncio.run(main(parser.parse_args())))
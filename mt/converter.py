@@ -1,26 +1,233 @@
 import re 
-import httpx  
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel 
-import subprocess  
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Match
+from pydantic import BaseModel, Field
 import datetime 
 from fastapi.middleware.cors import CORSMiddleware 
 import logging  
+from logging.handlers import RotatingFileHandler
 import os  
+import base64
+import time
+from typing import List, Literal, Optional, Union
+from mtx_client import CircuitBreaker, MediaMTXClient, MediaMTXUnavailable, endpoint_label
+from mtx_pool import MediaMTXNode, MediaMTXPool, NodeSpec, parse_nodes
+from metrics import ByteRates, Registry, merge_exposition, render_family
+from stream_index import StreamIndex, build_entry
+from stream_events import EventHub, format_sse
+from stream_stats import StreamStats
+from preview import PreviewEngine
+from readiness import ReadinessWatcher, is_ready
+from thumbnails import FORMATS, ThumbnailCache, ThumbnailError, render_thumbnail
+from log_store import TS_FORMAT, LogFilter, LogIndex, RingBufferHandler, tail_lines
 
 # Настройка логирования
+# Файл ротируется (LOG_MAX_BYTES × LOG_BACKUPS), последние записи дополнительно держатся в памяти для /logs?follow=true
+LOG_PATH = os.getenv("CONVERTER_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'converter.log'))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+log_buffer = RingBufferHandler(capacity=5000)
 logging.basicConfig(
     level=logging.INFO, 
     format='%(asctime)s %(levelname)s %(message)s', 
     handlers=[
-        logging.FileHandler('converter.log', encoding='utf-8'), 
-        logging.StreamHandler() 
+        RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8'), 
+        logging.StreamHandler(),
+        log_buffer,
     ]
 )
+log_index = LogIndex(LOG_PATH)
 logger = logging.getLogger(__name__)  # логгер для текущего модуля
 
-app = FastAPI()
+# Константы для работы с MediaMTX
+MEDIA_MTX_HOST = "localhost"
+MEDIA_MTX_PORT = 9997
+PATHS_CONFIG = "/config/paths"  # для управления путями
+PATHS_API    = "/paths"         # для получения информации о путях
+
+# Узлы MediaMTX через запятую: [имя=]http://host:9997[|rtsp://host:8554[|http://host:9998]]
+MEDIA_MTX_NODES = parse_nodes(os.getenv("MEDIA_MTX_NODES", f"http://{MEDIA_MTX_HOST}:{MEDIA_MTX_PORT}"))
+# Размещение новых путей: hash (consistent hashing) или least-load; период проверки узлов (секунды)
+# и число неудачных проверок подряд, после которого пути узла переносятся на другие
+MTX_PLACEMENT = os.getenv("MTX_PLACEMENT", "hash")
+MTX_HEALTH_INTERVAL = float(os.getenv("MTX_HEALTH_INTERVAL", "5.0"))
+MTX_DOWN_AFTER = int(os.getenv("MTX_DOWN_AFTER", "3"))
+
+# Параметры клиентов MediaMTX (таймауты в секундах)
+MTX_TIMEOUT = float(os.getenv("MTX_TIMEOUT", "2.0"))
+MTX_CONNECT_TIMEOUT = float(os.getenv("MTX_CONNECT_TIMEOUT", "1.0"))
+MTX_RETRIES = int(os.getenv("MTX_RETRIES", "2"))
+MTX_MAX_CONNECTIONS = int(os.getenv("MTX_MAX_CONNECTIONS", "50"))
+MTX_BREAKER_THRESHOLD = int(os.getenv("MTX_BREAKER_THRESHOLD", "5"))
+MTX_BREAKER_RESET = float(os.getenv("MTX_BREAKER_RESET", "10.0"))
+PATHS_PAGE_SIZE = 1000
+
+# Метрики для /metrics (формат Prometheus)
+metrics = Registry()
+http_requests = metrics.counter(
+    "converter_http_requests_total", "HTTP requests handled by the converter", ("method", "route", "status"))
+http_latency = metrics.histogram(
+    "converter_http_request_duration_seconds", "Time until response headers, by route", ("method", "route"))
+http_in_flight = metrics.gauge(
+    "converter_http_requests_in_flight", "HTTP requests currently being handled", ("method", "route"))
+mtx_latency = metrics.histogram(
+    "converter_mediamtx_request_duration_seconds", "MediaMTX API call duration, per attempt",
+    ("node", "method", "endpoint", "status"))
+
+def make_node(spec: NodeSpec, transport=None) -> MediaMTXNode:
+    """
+    Узел пула: клиент API с пулом соединений (один на всё приложение) и
+    отдельный клиент метрик MediaMTX (metrics: yes в mediamtx.yml), чтобы
+    недоступность метрик не открывала circuit breaker основного API.
+    """
+    client = MediaMTXClient(
+        spec.api_url + "/v3",
+        timeout=MTX_TIMEOUT,
+        connect_timeout=MTX_CONNECT_TIMEOUT,
+        retries=MTX_RETRIES,
+        max_connections=MTX_MAX_CONNECTIONS,
+        breaker=CircuitBreaker(MTX_BREAKER_THRESHOLD, MTX_BREAKER_RESET),
+        transport=transport,
+    )
+    client.observers.append(
+        lambda method, path, status, seconds: mtx_latency.observe(seconds, spec.name, method, endpoint_label(path), status)
+    )
+    metrics_client = MediaMTXClient(spec.metrics_url, timeout=MTX_TIMEOUT, connect_timeout=MTX_CONNECT_TIMEOUT, retries=0)
+    return MediaMTXNode(spec.name, client, spec.rtsp_base, metrics_client)
+
+mtx_pool = MediaMTXPool(
+    [make_node(spec) for spec in MEDIA_MTX_NODES],
+    placement=MTX_PLACEMENT,
+    health_interval=MTX_HEALTH_INTERVAL,
+    down_after=MTX_DOWN_AFTER,
+    page_size=PATHS_PAGE_SIZE,
+)
+
+# Индекс потоков: период фонового опроса MediaMTX и допустимый возраст снимка (секунды)
+STREAMS_REFRESH_INTERVAL = float(os.getenv("STREAMS_REFRESH_INTERVAL", "0.5"))
+STREAMS_MAX_STALENESS = float(os.getenv("STREAMS_MAX_STALENESS", "5.0"))
+
+async def fetch_all(list_path: str):
+    """Забирает все элементы списка со всех узлов MediaMTX (с постраничным обходом)"""
+    return await mtx_pool.fetch_all(list_path)
+
+async def fetch_paths():
+    return await fetch_all(f"{PATHS_API}/list")
+
+stream_index = StreamIndex(fetch_paths, STREAMS_REFRESH_INTERVAL, STREAMS_MAX_STALENESS)
+
+# Push-лента изменений потоков (SSE): размер очереди на клиента и период keepalive
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_KEEPALIVE = 15.0
+stream_events = EventHub(EVENTS_QUEUE_SIZE)
+stream_index.listeners.append(stream_events.on_refresh)
+
+# История счётчиков потоков для /streams/{key}/stats: период замеров (секунды) и число замеров на поток
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "2.0"))
+STATS_CAPACITY = int(os.getenv("STATS_CAPACITY", "1800"))
+STATS_MAX_POINTS = 1000  # предел точек в ответе — стоимость запроса ограничена
+stream_stats = StreamStats(STATS_INTERVAL, STATS_CAPACITY)
+stream_index.listeners.append(stream_stats.on_refresh)
+
+# Движок превью: сколько секунд держать в буфере и через сколько секунд без зрителей гасить ingest
+PREVIEW_BUFFER_SECONDS = float(os.getenv("PREVIEW_BUFFER_SECONDS", "4.0"))
+PREVIEW_IDLE_TIMEOUT = float(os.getenv("PREVIEW_IDLE_TIMEOUT", "15.0"))
+def rtsp_url_for(key: str) -> str:
+    return mtx_pool.rtsp_url(f"live/{key}")
+
+# Ожидание готовности потоков: период ускоренного обновления индекса, пока есть ожидающие, и предел ожидания (секунды)
+READY_POLL_INTERVAL = float(os.getenv("READY_POLL_INTERVAL", "0.2"))
+READY_MAX_WAIT = 60.0
+readiness = ReadinessWatcher(stream_index.request_refresh, rtsp_url_for, READY_POLL_INTERVAL)
+stream_index.listeners.append(readiness.on_refresh)
+
+preview_engine = PreviewEngine(
+    rtsp_url_for,
+    buffer_seconds=PREVIEW_BUFFER_SECONDS,
+    idle_timeout=PREVIEW_IDLE_TIMEOUT,
+)
+
+# Миниатюры: время жизни в кэше (секунды), лимит кэша в байтах и число одновременных декодирований
+THUMBNAIL_TTL = float(os.getenv("THUMBNAIL_TTL", "10.0"))
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_BYTES", str(32 * 1024 * 1024)))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "4"))
+thumbnail_workers = asyncio.Semaphore(THUMBNAIL_WORKERS)
+
+async def render_stream_thumbnail(key: str, width: int, fmt: str) -> bytes:
+    # если превью уже открыто, кадр берётся из его буфера без нового RTSP-подключения
+    session = preview_engine.sessions.get(key)
+    ts_data = session.keyframe_data() if session else b""
+    async with thumbnail_workers:
+        return await render_thumbnail(width, fmt, ts_data=ts_data or None, rtsp_url=rtsp_url_for(key))
+
+thumbnail_cache = ThumbnailCache(render_stream_thumbnail, THUMBNAIL_TTL, THUMBNAIL_CACHE_BYTES)
+
+# Скорости приёма/отдачи по потокам для /metrics
+stream_rates = ByteRates(window=float(os.getenv("STREAM_RATE_WINDOW", "5.0")))
+stream_index.listeners.append(stream_rates.on_refresh)
+
+def collect_runtime_metrics():
+    """Значения, которые считаются в момент запроса /metrics"""
+    nodes = list(mtx_pool.nodes.values())
+    lines = render_family("converter_mediamtx_node_up", "gauge", "1 if the MediaMTX node passed its last health check",
+                          [({"node": n.name}, 1 if n.healthy else 0) for n in nodes])
+    lines += render_family("converter_mediamtx_circuit_open", "gauge", "1 if the MediaMTX circuit breaker rejects calls",
+                           [({"node": n.name}, 0 if n.client.breaker.state == "closed" else 1) for n in nodes])
+    lines += render_family("converter_mediamtx_node_paths", "gauge", "Paths configured on the MediaMTX node",
+                           [({"node": n.name}, len(n.configs)) for n in nodes])
+    lines += render_family("converter_preview_processes", "gauge", "Running preview ingest ffmpeg processes",
+                           [({}, preview_engine.process_count)])
+    lines += render_family("converter_preview_clients", "gauge", "Connected preview clients",
+                           [({}, sum(len(s.clients) for s in preview_engine.sessions.values()))])
+    lines += render_family("converter_thumbnail_cache_bytes", "gauge", "Bytes held by the thumbnail cache",
+                           [({}, thumbnail_cache.total_bytes)])
+    lines += render_family("converter_events_subscribers", "gauge", "Connected /streams/events clients",
+                           [({}, len(stream_events.subscribers))])
+    return lines
+
+def collect_stream_metrics():
+    """Показатели по каждому потоку из последнего снимка индекса"""
+    entries = stream_index.entries
+    age = stream_index.age
+    lines = render_family("converter_stream_index_age_seconds", "gauge", "Age of the stream index snapshot",
+                          [({}, age if age != float("inf") else -1)])
+    lines += render_family("converter_streams", "gauge", "Paths known to MediaMTX", [({}, len(entries))])
+    lines += render_family("converter_stream_ready", "gauge", "1 if the stream is ready in MediaMTX",
+                           (({"stream": k, "node": e.get("node") or ""}, 1 if e["status"] == "running" else 0)
+                            for k, e in entries.items()))
+    lines += render_family("converter_stream_readers", "gauge", "Stream readers by protocol",
+                           (({"stream": k, "protocol": p}, n)
+                            for k, e in entries.items() for p, n in e["protocol_counts"].items()))
+    lines += render_family("converter_stream_received_bytes_total", "counter", "Bytes received by MediaMTX for the stream",
+                           (({"stream": k}, e["bytes_received"] or 0) for k, e in entries.items()))
+    lines += render_family("converter_stream_sent_bytes_total", "counter", "Bytes sent by MediaMTX for the stream",
+                           (({"stream": k}, e["bytes_sent"] or 0) for k, e in entries.items()))
+    rates = stream_rates.rates
+    lines += render_family("converter_stream_ingress_bytes_per_second", "gauge", "Ingress byte rate over the last rate window",
+                           (({"stream": k}, r[0]) for k, r in rates.items()))
+    lines += render_family("converter_stream_egress_bytes_per_second", "gauge", "Egress byte rate over the last rate window",
+                           (({"stream": k}, r[1]) for k, r in rates.items()))
+    return lines
+
+metrics.collectors += [collect_runtime_metrics, collect_stream_metrics]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_buffer.attach(asyncio.get_running_loop())
+    await mtx_pool.start()
+    await stream_index.start()
+    try:
+        yield
+    finally:
+        await preview_engine.close()
+        await readiness.close()
+        await stream_index.stop()
+        await mtx_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Настройка CORS (разрешение запросов с любых источников)
 app.add_middleware(
@@ -29,19 +236,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
-# Константы для работы с MediaMTX
-MEDIA_MTX_HOST = "localhost"
-MEDIA_MTX_PORT = 9997
-MEDIA_MTX_BASE = f"http://{MEDIA_MTX_HOST}:{MEDIA_MTX_PORT}/v3"
-PATHS_CONFIG = f"{MEDIA_MTX_BASE}/config/paths"  # для управления путями
-PATHS_API    = f"{MEDIA_MTX_BASE}/paths"        # для получения информации о путях
-
 # Модель данных для регистрации конвертации потока
 class StreamRegistration(BaseModel):
     """Модель для регистрации RTMP→RTSP конвертации"""
     rtmp_source: str
+    prewarm: bool = False  # забирать источник сразу и держать его подключённым (без sourceOnDemand)
+
+# Параллельность пакетной регистрации: по умолчанию и верхняя граница
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "16"))
+BULK_MAX_CONCURRENCY = 64
+
+class BulkRegistration(BaseModel):
+    """Пакетная регистрация: список RTMP-источников"""
+    sources: List[str]
+    concurrency: Optional[int] = Field(None, ge=1, le=BULK_MAX_CONCURRENCY)
+    prewarm: Union[bool, List[str]] = False  # true — все потоки, список — только эти stream_key
+
+class StreamSync(BulkRegistration):
+    """Желаемое состояние: пути live/*, которых нет в sources, удаляются (если prune)"""
+    prune: bool = True
+
+# MediaMTX недоступен (таймаут, сеть, открыт circuit breaker) → 503
+@app.exception_handler(MediaMTXUnavailable)
+async def mediamtx_unavailable(request: Request, exc: MediaMTXUnavailable):
+    logger.error(f"MediaMTX unavailable on {request.url.path}: {exc}")
+    return JSONResponse(status_code=503, content={"detail": "MediaMTX недоступен"})
 
 # Middleware для логирования всех HTTP-запросов и ответов
 @app.middleware('http')
@@ -55,12 +277,34 @@ async def log_requests(request: Request, call_next):
         logger.error(f"‼ Exception on {request.method} {request.url.path}: {e}")
         raise
 
-# Эндпоинт: конвертация RTMP потока в RTSP
-@app.post("/stream/convert")
-async def register_stream(req: StreamRegistration):
-    logger.info(f"Start converting stream: {req.rtmp_source}")
+def route_template(request: Request) -> str:
+    """Шаблон маршрута (/streams/{stream_key}) — метка метрик без кардинальности по ключам"""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+# Middleware для метрик: время до ответа (для SSE и превью — до заголовков) и число запросов в работе
+@app.middleware('http')
+async def collect_metrics(request: Request, call_next):
+    method, route = request.method, route_template(request)
+    http_in_flight.inc(method, route)
+    started = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        http_latency.observe(time.perf_counter() - started, method, route)
+        http_requests.inc(method, route, status)
+        http_in_flight.dec(method, route)
+
+def normalize_source(rtmp_source: str):
+    """Нормализует RTMP-источник и извлекает ключ потока; ValueError при неверном формате"""
     # нормализуется и перенаправляется хост внутри Docker, если это локальный RTMP
-    src = req.rtmp_source.strip()
+    src = rtmp_source.strip()
     local_match = re.match(r"^rtmp://(localhost|127\.0\.0\.1)(:\d+)?(/live/[^/]+)$", src)
     if local_match:
         host, port, path = local_match.groups()
@@ -72,171 +316,473 @@ async def register_stream(req: StreamRegistration):
     # извлекается ключ потока из URL (последняя часть после /live/)
     m = re.match(r"^rtmp://[^/]+/live/([^/]+)$", src)
     if not m:
+        raise ValueError("rtmp_source должен быть вида rtmp://<host>/live/<stream_key>")
+    return src, m.group(1)
+
+# Эндпоинт: конвертация RTMP потока в RTSP
+@app.post("/stream/convert")
+async def register_stream(
+    req: StreamRegistration,
+    wait_ready: Optional[float] = Query(None, gt=0, le=READY_MAX_WAIT, description="ждать готовности потока до N секунд"),
+):
+    logger.info(f"Start converting stream: {req.rtmp_source}")
+    try:
+        src, key = normalize_source(req.rtmp_source)
+    except ValueError as e:
         logger.error("Bad rtmp_source format")
-        raise HTTPException(400, detail="rtmp_source должен быть вида rtmp://<host>/live/<stream_key>")
-    key = m.group(1)
+        raise HTTPException(400, detail=str(e))
 
-    # формируется имя пути и итоговый RTSP URL
+    # выбирается узел MediaMTX, формируются имя пути и итоговый RTSP URL
     path_name = f"live/{key}"
-    rtsp_url = f"rtsp://{MEDIA_MTX_HOST}:8554/{path_name}"
-    logger.info(f"Register path {path_name} → {rtsp_url}")
+    node = mtx_pool.place(path_name)
+    rtsp_url = node.rtsp_url(path_name)
+    logger.info(f"Register path {path_name} on {node.name} → {rtsp_url}")
 
     # регистрируется путь в MediaMTX через HTTP API
-    payload = {"source": src, "sourceOnDemand": True}
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{PATHS_CONFIG}/add/{path_name}", json=payload)
+    payload = {"source": src, "sourceOnDemand": not req.prewarm}
+    # при ошибке снимается только назначение, созданное этим запросом: повторная
+    # регистрация существующего пути (400 от MediaMTX) не должна стирать его запись в пуле
+    created = mtx_pool.node_of(path_name) is None
+    mtx_pool.assign(path_name, node)
+    try:
+        resp = await node.client.post(f"{PATHS_CONFIG}/add/{path_name}", json=payload)
+    except MediaMTXUnavailable:
+        if created:
+            mtx_pool.unassign(path_name, node)
+        raise
     if resp.status_code != 200:
+        if created:
+            mtx_pool.unassign(path_name, node)
         logger.error(f"MediaMTX register error {resp.status_code}: {resp.text}")
         raise HTTPException(500, detail=f"Ошибка регистрации: {resp.status_code} {resp.text}")
+    mtx_pool.assign(path_name, node, payload)
 
     logger.info(f"Stream registered: {key}")
-    return {
+    stream_index.request_refresh()
+    result = {
         "rtmp_source": req.rtmp_source,
         "rtsp_url": rtsp_url,
+        "node": node.name,
         "status": "registered",
-        "note": "ВАЖНО: После получения rtsp_url подождите 15–20 секунд перед подключением, чтобы поток успел инициализироваться"
+        "prewarm": req.prewarm,
     }
+    if wait_ready is None:
+        result["note"] = f"Поток инициализируется: дождитесь готовности через GET /streams/{key}/ready или передайте ?wait_ready=<секунды>"
+        return result
+
+    # ответ уходит, как только MediaMTX отметит путь готовым (с дорожками), а не через фиксированную паузу
+    started = asyncio.get_running_loop().time()
+    entry = await readiness.wait(key, wait_ready, on_demand=not req.prewarm)
+    result.update(ready=entry is not None, waited_seconds=round(asyncio.get_running_loop().time() - started, 3))
+    if entry is not None:
+        logger.info(f"Stream ready: {key} after {result['waited_seconds']}s")
+        result.update(status="ready", tracks=entry["tracks"])
+    else:
+        logger.warning(f"Stream not ready after {wait_ready}s: {key}")
+        result["note"] = f"Поток ещё не готов: проверьте источник или дождитесь готовности через GET /streams/{key}/ready"
+    return result
+async def reconcile(sources: List[str], concurrency: Optional[int], prune: bool, prewarm: Union[bool, List[str]] = False):
+    """
+    Приводит пути MediaMTX к списку sources: сравнивает с config/paths всех
+    узлов и выполняет только нужные add / patch / delete с ограниченной
+    параллельностью. Новые пути размещаются по стратегии пула, существующие
+    меняются на своём узле. Повторный вызов с тем же списком ничего не меняет.
+    """
+    current = {c.get("name"): c for c in await fetch_all(f"{PATHS_CONFIG}/list")}
+    results, desired, ops = [], {}, []
+    created = set()  # пути, назначенные узлу этим вызовом (только их откатывает ошибка add)
+    for raw in sources:
+        item = {"rtmp_source": raw}
+        results.append(item)
+        try:
+            src, key = normalize_source(raw)
+        except ValueError as e:
+            item.update(status="error", detail=str(e))
+            continue
+        path_name = f"live/{key}"
+        if path_name in desired:
+            item.update(stream_key=key, status="error", detail="stream_key повторяется в запросе")
+            continue
+        desired[path_name] = src
+        on_demand = not (prewarm if isinstance(prewarm, bool) else key in prewarm)
+        payload = {"source": src, "sourceOnDemand": on_demand}
+        conf = current.get(path_name)
+        if conf is None:
+            try:
+                node = mtx_pool.place(path_name)
+            except MediaMTXUnavailable as e:
+                item.update(stream_key=key, status="error", detail=f"MediaMTX недоступен: {e}")
+                continue
+            # назначение сразу, чтобы least-load учитывал пути из этого же запроса
+            if mtx_pool.node_of(path_name) is None:
+                created.add(path_name)
+            mtx_pool.assign(path_name, node)
+            ops.append((item, "registered", node, "post", path_name, payload))
+        else:
+            node = mtx_pool.nodes[conf["node"]]
+            if conf.get("source") != src or conf.get("sourceOnDemand") is not on_demand:
+                ops.append((item, "updated", node, "patch", path_name, payload))
+            else:
+                item["status"] = "unchanged"
+        item.update(stream_key=key, rtsp_url=node.rtsp_url(path_name), node=node.name)
+    if prune:
+        for path_name, conf in current.items():
+            if path_name and path_name.startswith("live/") and path_name not in desired:
+                item = {"stream_key": path_name.split("/", 1)[-1], "node": conf["node"]}
+                results.append(item)
+                ops.append((item, "deleted", mtx_pool.nodes[conf["node"]], "delete", path_name, None))
+
+    sem = asyncio.Semaphore(concurrency or BULK_CONCURRENCY)
+
+    async def apply(item, status, node, method, path_name, payload):
+        url = f"{PATHS_CONFIG}/{'add' if method == 'post' else method}/{path_name}"
+        call = getattr(node.client, method)
+        async with sem:
+            try:
+                resp = await (call(url, json=payload) if payload is not None else call(url))
+            except MediaMTXUnavailable as e:
+                resp = None
+                item.update(status="error", detail=f"MediaMTX недоступен: {e}")
+        if resp is not None and resp.status_code == 200:
+            item["status"] = status
+            if status == "deleted":
+                mtx_pool.unassign(path_name, node)
+            else:
+                mtx_pool.assign(path_name, node, payload)
+            return
+        if resp is not None:
+            item.update(status="error", detail=f"{resp.status_code} {resp.text}")
+        if status == "registered" and path_name in created:
+            mtx_pool.unassign(path_name, node)
+
+    await asyncio.gather(*(apply(*op) for op in ops))
+    if ops:
+        stream_index.request_refresh()
+    summary = {}
+    for item in results:
+        summary[item["status"]] = summary.get(item["status"], 0) + 1
+    logger.info(f"Reconciled {len(sources)} sources: {summary}")
+    return {"results": results, "summary": summary}
+
+# Эндпоинт: пакетная регистрация потоков (уже существующие пути обновляются или пропускаются)
+@app.post("/streams/bulk")
+async def register_streams_bulk(req: BulkRegistration):
+    logger.info(f"Bulk register {len(req.sources)} sources")
+    return await reconcile(req.sources, req.concurrency, prune=False, prewarm=req.prewarm)
+
+# Эндпоинт: синхронизация с желаемым набором потоков
+@app.put("/streams/sync")
+async def sync_streams(req: StreamSync):
+    logger.info(f"Sync {len(req.sources)} sources (prune={req.prune})")
+    return await reconcile(req.sources, req.concurrency, prune=req.prune, prewarm=req.prewarm)
+
+# Эндпоинт: push-лента состояния потоков (server-sent events)
+# Сначала отдаётся полный снимок, затем только изменения из общего фонового наблюдателя
+@app.get("/streams/events")
+async def stream_events_feed(request: Request):
+    logger.info("Stream events subscriber connected")
+    index = await stream_index.snapshot()
+    sub = stream_events.subscribe()
+
+    async def feed():
+        try:
+            yield format_sse("snapshot", index.body)
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.get(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    # клиент не успевал читать — EventSource переподключится и получит свежий снимок
+                    break
+                yield format_sse(*event)
+        finally:
+            stream_events.unsubscribe(sub)
+            logger.info("Stream events subscriber disconnected")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(feed(), media_type="text/event-stream", headers=headers)
+
+# Эндпоинт: миниатюры всех (или перечисленных) потоков одним запросом, в виде data URI
+@app.get("/streams/thumbnails")
+async def stream_thumbnails(
+    keys: Optional[str] = Query(None, description="ключи через запятую; по умолчанию все запущенные потоки"),
+    width: int = Query(320, ge=16, le=1920),
+    format: Literal["jpeg", "webp"] = "jpeg",
+):
+    if keys:
+        wanted = [k for k in (k.strip() for k in keys.split(",")) if k]
+    else:
+        index = await stream_index.snapshot()
+        wanted = [k for k, e in index.entries.items() if e["status"] == "running"]
+    logger.info(f"Thumbnails request for {len(wanted)} streams")
+
+    async def one(key):
+        try:
+            return key, await thumbnail_cache.get(key, width, format), None
+        except FileNotFoundError:
+            return key, None, "ffmpeg не найден в PATH"
+        except ThumbnailError as e:
+            return key, None, str(e)
+
+    mime = FORMATS[format][1]
+    thumbs, errors = {}, {}
+    # параллельность ограничена пулом декодирования thumbnail_workers
+    for key, data, err in await asyncio.gather(*(one(k) for k in wanted)):
+        if data is not None:
+            thumbs[key] = f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
+        else:
+            errors[key] = err
+    return {"thumbnails": thumbs, "errors": errors}
+
+def uptime_seconds(ready_ts):
+    """Время работы потока (в секундах) по readyTime из MediaMTX"""
+    if not ready_ts:
+        return None
+    iso = ready_ts.rstrip('Z') + '+00:00'
+    try:
+        started = datetime.datetime.fromisoformat(iso)
+    except ValueError:
+        logger.warning("Failed parse readyTime for uptime")
+        return None
+    now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
+    return (now - started).total_seconds()
+
 @app.get("/streams/{stream_key}")
 async def get_stream_info(stream_key: str):
     logger.info(f"Fetch info for stream: {stream_key}")
-    url = f"{PATHS_API}/get/live/{stream_key}"  # URL для получения статуса
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url)
-    if resp.status_code == 404:
-        logger.warning(f"Stream not found: {stream_key}")
-        raise HTTPException(404, detail="Stream not found")
-    if resp.status_code != 200:
-        logger.error(f"MediaMTX GET error {resp.status_code}")
-        raise HTTPException(500, detail=f"MediaMTX error: {resp.status_code}")
-
-    info = resp.json()  # реакция API MediaMTX
-    # вычисление времени работы (uptime) в секундах
-    uptime = None
-    ready_ts = info.get("readyTime")
-    if ready_ts:
-        iso = ready_ts.rstrip('Z') + '+00:00'
-        try:
-            started = datetime.datetime.fromisoformat(iso)
-            now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
-            uptime = (now - started).total_seconds()
-        except ValueError:
-            logger.warning("Failed parse readyTime for uptime")
-
-    # считается количество читателей по протоколам
-    readers = info.get("readers", [])
-    proto_counts = {}
-    for r in readers:
-        p = r.get("protocol", "unknown")
-        proto_counts[p] = proto_counts.get(p, 0) + 1
+    entry = (await stream_index.snapshot()).entries.get(stream_key)
+    if entry is None:
+        # поток мог появиться после последнего обновления индекса — спрашиваем MediaMTX напрямую
+        itm = await mtx_pool.get_path(f"live/{stream_key}")
+        if itm is None:
+            logger.warning(f"Stream not found: {stream_key}")
+            raise HTTPException(404, detail="Stream not found")
+        entry = build_entry(itm)
+        stream_index.request_refresh()
 
     # формируется ответ для клиента
     result = {
         "stream_key": stream_key,
-        "status": "running" if info.get("ready") else "stopped",
-        "uptime_seconds": uptime,
-        "bytes_received": info.get("bytesReceived"),
-        "bytes_sent": info.get("bytesSent"),
-        "source": info.get("source"),
-        "tracks": info.get("tracks"),
-        "readers_count": len(readers),
-        "protocol_counts": proto_counts,
+        "status": entry["status"],
+        "uptime_seconds": uptime_seconds(entry["ready_time"]),
+        "bytes_received": entry["bytes_received"],
+        "bytes_sent": entry["bytes_sent"],
+        "source": entry["source"],
+        "tracks": entry["tracks"],
+        "readers_count": entry["readers_count"],
+        "protocol_counts": entry["protocol_counts"],
+        "node": entry["node"],
+        "rtsp_url": rtsp_url_for(stream_key),
     }
     logger.info(f"Info returned for {stream_key}: {result}")
     return result
 
+# Эндпоинт: long-poll готовности потока — ответ сразу, как только поток готов, или по истечении timeout
+@app.get("/streams/{stream_key}/ready")
+async def stream_ready(stream_key: str, timeout: float = Query(20, ge=0, le=READY_MAX_WAIT)):
+    logger.info(f"Readiness wait for: {stream_key} (timeout {timeout}s)")
+    path_name = f"live/{stream_key}"
+    entry = (await stream_index.snapshot()).entries.get(stream_key)
+    node = mtx_pool.node_of(path_name)
+    if entry is None and node is None:
+        itm = await mtx_pool.get_path(path_name)
+        if itm is None:
+            logger.warning(f"Stream not found: {stream_key}")
+            raise HTTPException(404, detail="Stream not found")
+        entry = build_entry(itm)
+    conf = node.configs.get(path_name, {}) if node is not None else {}
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    if is_ready(entry) or not timeout:
+        ready = entry if is_ready(entry) else None
+    else:
+        ready = await readiness.wait(stream_key, timeout, current=entry, on_demand=conf.get("sourceOnDemand", True))
+    return {
+        "stream_key": stream_key,
+        "ready": ready is not None,
+        "waited_seconds": round(loop.time() - started, 3),
+        "tracks": ready["tracks"] if ready is not None else [],
+        "rtsp_url": rtsp_url_for(stream_key),
+    }
+
 # Эндпоинт: список всех зарегистрированных потоков
 @app.get("/streams")
-async def list_streams():
+async def list_streams(request: Request):
     logger.info("List all streams")
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{PATHS_API}/list")
-    if resp.status_code != 200:
-        logger.error(f"MediaMTX list error {resp.status_code}")
-        raise HTTPException(500, detail="Ошибка получения списка стримов")
-
-    items = resp.json().get("items", [])
-    result = []
-    for itm in items:
-        key = itm.get("name", "").split('/', 1)[-1]
-        readers = itm.get("readers", [])
-        proto_counts = {}
-        for r in readers:
-            p = r.get("protocol", "unknown")
-            proto_counts[p] = proto_counts.get(p, 0) + 1
-
-        raw_tracks = itm.get("tracks", [])
-        track_counts = {}
-        for t in raw_tracks:
-            if isinstance(t, dict):
-                ttype = t.get("type") or "unknown"
-            elif isinstance(t, str):
-                ttype = t.split(":", 1)[0]
-            else:
-                ttype = "unknown"
-            track_counts[ttype] = track_counts.get(ttype, 0) + 1
-
-        entry = {
-            "stream_key": key,
-            "status": "running" if itm.get("ready") else "stopped",
-            "ready_time": itm.get("readyTime"),
-            "bytes_received": itm.get("bytesReceived"),
-            "bytes_sent": itm.get("bytesSent"),
-            "source": itm.get("source"),
-            "readers_count": len(readers),
-            "protocol_counts": proto_counts,
-            "tracks": raw_tracks,
-            "track_counts": track_counts,
-        }
-        result.append(entry)
-
-    logger.info(f"Streams list returned ({len(result)} items)")
-    return {"streams": result}
+    index = await stream_index.snapshot()
+    headers = {"ETag": index.etag, "Cache-Control": "no-cache"}
+    # снимок не изменился — клиенту достаточно 304 без тела
+    if request.headers.get("if-none-match") == index.etag:
+        return Response(status_code=304, headers=headers)
+    logger.info(f"Streams list returned ({len(index.entries)} items)")
+    return Response(content=index.body, media_type="application/json", headers=headers)
+
+# Эндпоинт: метрики в формате Prometheus; ?mediamtx=true — с добавлением метрик самого MediaMTX
+@app.get("/metrics")
+async def get_metrics(mediamtx: bool = False):
+    body = metrics.render()
+    if mediamtx:
+        nodes = list(mtx_pool.nodes.values())
+
+        async def scrape(node):
+            try:
+                resp = await node.metrics_client.get("/metrics")
+            except MediaMTXUnavailable as e:
+                logger.warning(f"MediaMTX metrics unavailable on {node.name}: {e}")
+                return None
+            if resp.status_code != 200:
+                logger.warning(f"MediaMTX metrics error {resp.status_code} on {node.name}")
+                return None
+            return resp.text
+
+        texts = dict(zip((n.name for n in nodes), await asyncio.gather(*(scrape(n) for n in nodes))))
+        # метрики узлов сливаются в одно семейство на имя, каждая строка получает метку node
+        body += merge_exposition({name: text for name, text in texts.items() if text is not None})
+        body += "\n".join(render_family("converter_mediamtx_metrics_up", "gauge",
+                                         "1 if MediaMTX metrics were merged into this response",
+                                         [({"node": name}, 0 if text is None else 1) for name, text in texts.items()])) + "\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 # Эндпоинт: проверка доступности MediaMTX
+# ok — все узлы отвечают, degraded — часть узлов недоступна (их пути перенесены), 503 — ни одного
+# Только чтение: состояние узлов берётся из фоновой проверки пула, сам запрос конфигурацию не меняет
 @app.get("/health")
 async def health():
     logger.info("Health check")
-    try:
-        async with httpx.AsyncClient(timeout=2) as client:
-            resp = await client.get(f"{PATHS_API}/list")
-        if resp.status_code == 200:
-            logger.info("MediaMTX is healthy")
-            return {"status": "ok"}
-    except httpx.RequestError as e:
-        logger.error(f"Health check failed: {e}")
-    raise HTTPException(503, detail="MediaMTX unavailable")
-
-# Эндпоинт: получение короткого превью потока (первые 5 секунд)
+    nodes = [n.info() for n in mtx_pool.nodes.values()]
+    healthy = sum(1 for n in nodes if n["healthy"])
+    if not healthy:
+        logger.error("Health check failed: no MediaMTX nodes available")
+        raise HTTPException(503, detail="MediaMTX unavailable")
+    status = "ok" if healthy == len(nodes) else "degraded"
+    logger.info(f"MediaMTX is {status} ({healthy}/{len(nodes)} nodes)")
+    return {"status": status, "placement": mtx_pool.placement, "nodes": nodes}
+
+# Эндпоинт: превью потока (MPEG-TS, по умолчанию 5 секунд)
+# Все клиенты одного потока читают общий ingest: первые байты сразу из буфера с ключевого кадра
 @app.get("/streams/{stream_key}/preview")
-def preview(stream_key: str):
+async def preview(stream_key: str, duration: float = Query(5, gt=0, le=300)):
     logger.info(f"Preview request for: {stream_key}")
-    rtsp = f"rtsp://{MEDIA_MTX_HOST}:8554/live/{stream_key}"
-    # команда ffmpeg для захвата 5 секунд и копирования потока без перекодирования
-    cmd = [
-        "ffmpeg", "-rtsp_transport", "tcp",
-        "-i", rtsp,
-        "-t", "5",
-        "-c", "copy",
-        "-f", "mpegts",
-        "pipe:1",
-    ]
     try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        session = await preview_engine.session(stream_key)
+    except FileNotFoundError:
+        logger.error("ffmpeg not found")
+        raise HTTPException(500, detail="ffmpeg не найден в PATH")
+    queue = session.subscribe()
+
+    async def body():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            session.unsubscribe(queue)
+
+    return StreamingResponse(body(), media_type="video/mp2t")
+
+# Эндпоинт: битрейт приёма/отдачи и число читателей за последние window секунд с шагом step
+@app.get("/streams/{stream_key}/stats")
+async def stream_stats_series(
+    stream_key: str,
+    window: float = Query(300, gt=0, description="интервал истории, секунды"),
+    step: Optional[float] = Query(None, gt=0, description="шаг точек, секунды; по умолчанию window/60"),
+):
+    logger.info(f"Stats request for: {stream_key}")
+    series = stream_stats.series.get(stream_key)
+    if series is None:
+        raise HTTPException(404, detail="Stream not found")
+    window = min(window, stream_stats.retention)
+    step = max(step or window / 60, STATS_INTERVAL)
+    if window / step > STATS_MAX_POINTS:
+        raise HTTPException(400, detail=f"Слишком много точек: window/step не больше {STATS_MAX_POINTS}")
+    return {
+        "stream_key": stream_key,
+        "window": window,
+        "step": step,
+        "interval": STATS_INTERVAL,
+        **series.query(window, step),
+    }
+
+# Эндпоинт: миниатюра потока (последний ключевой кадр) в JPEG/WebP
+@app.get("/streams/{stream_key}/thumbnail")
+async def stream_thumbnail(
+    stream_key: str,
+    width: int = Query(320, ge=16, le=1920),
+    format: Literal["jpeg", "webp"] = "jpeg",
+):
+    logger.info(f"Thumbnail request for: {stream_key}")
+    try:
+        data = await thumbnail_cache.get(stream_key, width, format)
     except FileNotFoundError:
         logger.error("ffmpeg not found")
         raise HTTPException(500, detail="ffmpeg не найден в PATH")
-    return StreamingResponse(proc.stdout, media_type="video/mp2t")
+    except ThumbnailError as e:
+        logger.warning(f"Thumbnail failed for {stream_key}: {e}")
+        raise HTTPException(502, detail=f"Не удалось получить кадр: {e}")
+    headers = {"Cache-Control": f"max-age={int(THUMBNAIL_TTL)}"}
+    return Response(content=data, media_type=FORMATS[format][1], headers=headers)
 
 # Эндпоинт: получение последних строк из лога приложения
+def log_timestamp(value: Optional[datetime.datetime]) -> Optional[str]:
+    """Переводит время из запроса в формат asctime (локальное время), чтобы сравнивать строки"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.strftime(TS_FORMAT) + f",{value.microsecond // 1000:03d}"
+
 @app.get("/logs")
-async def get_logs(lines: int = Query(200, ge=1, le=1000)):
+async def get_logs(
+    lines: int = Query(200, ge=1, le=1000),
+    follow: bool = Query(False, description="держать соединение и присылать новые строки (SSE)"),
+    level: Optional[str] = Query(None, description="минимальный уровень: DEBUG, INFO, WARNING, ERROR"),
+    stream_key: Optional[str] = Query(None, description="только строки, упоминающие поток"),
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+):
     logger.info(f"Fetching last {lines} log lines")
-    log_path = os.path.join(os.path.dirname(__file__), 'converter.log')
-    if not os.path.isfile(log_path):
+    flt = LogFilter(level, stream_key, log_timestamp(since), log_timestamp(until))
+    # последние записи из буфера в памяти; запоминаем номер, чтобы follow продолжил с него
+    last_seq = log_buffer.seq
+    if not os.path.isfile(LOG_PATH):
         logger.warning("Log file not found")
-        return {"logs": []}
-    # читается файл лога и отдаются последние N строк
-    with open(log_path, encoding='utf-8') as f:
-        all_lines = f.readlines()
-    recent = all_lines[-lines:]
-    return {"logs": recent}
+        recent = []
+    elif flt.empty:
+        # хвост файла читается с конца, время ответа не зависит от размера лога
+        recent = await asyncio.to_thread(tail_lines, LOG_PATH, lines)
+    else:
+        recent = await asyncio.to_thread(log_index.search, flt, lines)
+    if not follow:
+        return {"logs": recent}
+
+    async def feed():
+        seq = last_seq
+        for line in recent:
+            yield format_sse("log", line)
+        while True:
+            await log_buffer.wait(seq, EVENTS_KEEPALIVE)
+            newest, records = log_buffer.since(seq)
+            if not records:
+                yield ": keepalive\n\n"
+                continue
+            if records[0][0] > seq + 1:
+                yield format_sse("gap", {"missed": records[0][0] - seq - 1})
+            for _, ts, lvl, line in records:
+                if flt.match(ts, lvl, line):
+                    yield format_sse("log", line)
+            seq = newest
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(feed(), media_type="text/event-stream", headers=headers)
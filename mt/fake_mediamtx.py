@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import datetime
+import random
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeMediaMTX:
+    """
+    Заглушка HTTP API MediaMTX v3 для бенчмарков и локальной отладки конвертера.
+    Держит пути в памяти: paths штук live/bench0000… (нумерация с first — чтобы
+    несколько заглушек изображали разные узлы) уже готовых потоков с readers
+    читателями каждый. Ко всем ответам добавляется задержка
+    latency + случайная до jitter секунд, а с вероятностью error_rate
+    вместо ответа возвращается error_status (по умолчанию 503).
+    """
+
+    def __init__(
+        self,
+        paths: int = 100,
+        readers: int = 3,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: Optional[int] = None,
+        first: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.readers = readers
+        self.random = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        self.configs: Dict[str, dict] = {}
+        self.paths: Dict[str, dict] = {}
+        for i in range(first, first + paths):
+            name = f"live/bench{i:04d}"
+            self.add_path(name, {"source": f"rtmp://nginx-rtmp:1935/{name}", "sourceOnDemand": True}, ready=True)
+
+    def add_path(self, name: str, conf: dict, ready: bool = False):
+        self.configs[name] = {"name": name, **conf}
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+        self.paths[name] = {
+            "name": name,
+            "confName": name,
+            "source": {"type": "rtmpSource", "id": ""} if ready else None,
+            "ready": ready,
+            "readyTime": now if ready else None,
+            "tracks": ["H264", "MPEG-4 Audio"] if ready else [],
+            "bytesReceived": self.random.randint(10 ** 6, 10 ** 9) if ready else 0,
+            "bytesSent": self.random.randint(10 ** 6, 10 ** 9) if ready else 0,
+            "readers": [
+                {"type": "rtspSession", "id": f"{name}-{j}", "protocol": self.random.choice(["rtsp", "webrtc", "hls"])}
+                for j in range(self.readers if ready else 0)
+            ],
+        }
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI(title="Fake MediaMTX API")
+
+        @app.middleware("http")
+        async def inject(request: Request, call_next):
+            route = request.url.path.split("/")[2:4]
+            name = "/".join(route)
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            if self.error_rate and self.random.random() < self.error_rate:
+                return JSONResponse({"error": "injected error"}, status_code=self.error_status)
+            return await call_next(request)
+
+        def page(items, request: Request):
+            per_page = int(request.query_params.get("itemsPerPage", "100"))
+            number = int(request.query_params.get("page", "0"))
+            count = (len(items) + per_page - 1) // per_page
+            return {
+                "itemCount": len(items),
+                "pageCount": count,
+                "items": items[number * per_page:(number + 1) * per_page],
+            }
+
+        @app.get("/v3/paths/list")
+        async def paths_list(request: Request):
+            return page(list(self.paths.values()), request)
+
+        @app.get("/v3/paths/get/{name:path}")
+        async def paths_get(name: str):
+            if name not in self.paths:
+                return JSONResponse({"error": "path not found"}, status_code=404)
+            return self.paths[name]
+
+        @app.get("/v3/config/paths/list")
+        async def config_list(request: Request):
+            return page(list(self.configs.values()), request)
+
+        @app.post("/v3/config/paths/add/{name:path}")
+        async def config_add(name: str, request: Request):
+            if name in self.configs:
+                return JSONResponse({"error": "path already exists"}, status_code=400)
+            self.add_path(name, await request.json())
+            return {}
+
+        @app.patch("/v3/config/paths/patch/{name:path}")
+        async def config_patch(name: str, request: Request):
+            if name not in self.configs:
+                return JSONResponse({"error": "path not found"}, status_code=404)
+            self.configs[name].update(await request.json())
+            return {}
+
+        @app.delete("/v3/config/paths/delete/{name:path}")
+        async def config_delete(name: str):
+            if self.configs.pop(name, None) is None:
+                return JSONResponse({"error": "path not found"}, status_code=404)
+            self.paths.pop(name, None)
+            return {}
+
+        return app
+
+
+if __name__ == "__main__":
+    # отдельный процесс вместо настоящего MediaMTX: python fake_mediamtx.py --paths 500 --latency 0.005
+    # несколько узлов: --port 9997 --first 0 и --port 9987 --first 500, MEDIA_MTX_NODES=http://127.0.0.1:9997,http://127.0.0.1:9987
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Заглушка HTTP API MediaMTX v3")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9997)
+    parser.add_argument("--paths", type=int, default=100)
+    parser.add_argument("--first", type=int, default=0, help="номер первого пути (для нескольких узлов)")
+    parser.add_argument("--readers", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+    fake = FakeMediaMTX(
+        args.paths, args.readers, args.latency, args.jitter, args.error_rate, args.error_status, first=args.first
+    )
+    uvicorn.run(fake.create_app(), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,307 @@
+import asyncio
+import bisect
+import collections
+import glob
+import logging
+import os
+import re
+import threading
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+# формат строк лога: "2025-05-25 13:52:59,160 INFO сообщение"
+LINE_RE = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) ([A-Z]+) ")
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+def tail_lines(path: str, n: int, block_size: int = 8192) -> List[str]:
+    """Последние n строк файла: читаем блоки с конца, пока не наберём n переводов строки"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.splitlines(keepends=True)
+    return [line.decode("utf-8", errors="replace") for line in lines[-n:]]
+
+
+class LogFilter:
+    """Фильтр по уровню, ключу потока и диапазону времени (строки в формате asctime)"""
+
+    def __init__(
+        self,
+        level: Optional[str] = None,
+        stream_key: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ):
+        self.min_level = LEVELS.get(level.upper(), 0) if level else 0
+        self.stream_re = re.compile(rf"\b{re.escape(stream_key)}\b") if stream_key else None
+        # быстрая проверка по байтам до декодирования строки
+        self.stream_bytes = stream_key.encode() if stream_key else None
+        self.since = since
+        self.until = until
+
+    @property
+    def empty(self) -> bool:
+        return not (self.min_level or self.stream_re or self.since or self.until)
+
+    def match(self, ts: Optional[str], level: Optional[str], line: str) -> bool:
+        if self.min_level and LEVELS.get(level or "", 0) < self.min_level:
+            return False
+        if ts is not None:
+            if self.since and ts < self.since:
+                return False
+            if self.until and ts > self.until:
+                return False
+        if self.stream_re and not self.stream_re.search(line):
+            return False
+        return True
+
+
+def reverse_lines(path: str, start: int, end: int, block_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Строки файла в диапазоне [start, end) от последней к первой; читаем блоками с конца"""
+    with open(path, "rb") as f:
+        pos = end
+        rest = None
+        while pos > start:
+            step = min(block_size, pos - start)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + (rest if rest is not None else b"")).split(b"\n")
+            if rest is None:
+                lines.pop()  # end стоит сразу после перевода строки
+            # первая строка блока может начинаться в предыдущем блоке
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                yield line + b"\n"
+        if rest is not None:
+            yield rest + b"\n"
+
+
+class LogIndex:
+    """
+    Разреженный индекс смещений по файлам лога (текущему и ротированным).
+    Примерно каждые step байт запоминается пара (время строки, смещение),
+    поэтому since/until сужают поиск до диапазона байт бинарным поиском;
+    для каждого блока между метками хранится максимальный уровень записей,
+    и при фильтре по уровню блоки без подходящих записей не читаются.
+    Поиск идёт от новых строк к старым и останавливается, как только
+    набрано limit совпадений. Для активного файла индекс дописывается
+    инкрементально, ротированные файлы индексируются один раз.
+    search вызывается из нескольких потоков (asyncio.to_thread), поэтому
+    индекс обновляется под блокировкой, а списки заменяются новыми целиком.
+    """
+
+    def __init__(self, path: str, step: int = 64 * 1024):
+        self.path = path
+        self.step = step
+        # путь → (inode, проиндексированный размер, метки времени, смещения, максимальный уровень блока)
+        self._files: Dict[str, Tuple[int, int, List[str], List[int], List[int]]] = {}
+        self._lock = threading.Lock()
+
+    def files(self) -> List[str]:
+        """Файлы лога от старых к новым: converter.log.N … converter.log.1, converter.log"""
+        rotated = []
+        for p in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = p.rsplit(".", 1)[-1]
+            if suffix.isdigit():
+                rotated.append((int(suffix), p))
+        ordered = [p for _, p in sorted(rotated, reverse=True)]
+        if os.path.isfile(self.path):
+            ordered.append(self.path)
+        return ordered
+
+    def _update(self, path: str) -> Tuple[int, List[str], List[int], List[int]]:
+        """Индекс файла: (размер до последней целой строки, метки времени, смещения, уровни блоков)"""
+        with self._lock:
+            st = os.stat(path)
+            cached = self._files.get(path)
+            if cached and cached[0] == st.st_ino and cached[1] <= st.st_size:
+                inode, indexed, stamps, offsets, levels = cached
+            else:
+                inode, indexed, stamps, offsets, levels = st.st_ino, 0, [], [], []
+            if indexed < st.st_size:
+                # новые списки: ссылки, выданные другим потокам, не меняются у них под руками
+                stamps, offsets, levels = list(stamps), list(offsets), list(levels)
+                with open(path, "rb") as f:
+                    f.seek(indexed)
+                    pos = indexed
+                    next_mark = offsets[-1] + self.step if offsets else 0
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            # недописанная строка — проиндексируем в следующий раз
+                            break
+                        m = LINE_RE.match(line)
+                        if m:
+                            level = LEVELS.get(m.group(2).decode(), 0)
+                            if pos >= next_mark:
+                                # блок начинается со строки с меткой, записи не переходят через границу блока
+                                stamps.append(m.group(1).decode())
+                                offsets.append(pos)
+                                levels.append(level)
+                                next_mark = pos + self.step
+                            elif levels and level > levels[-1]:
+                                levels[-1] = level
+                        pos += len(line)
+                indexed = pos
+                self._files[path] = (inode, indexed, stamps, offsets, levels)
+            return indexed, stamps, offsets, levels
+
+    @staticmethod
+    def _ranges(size: int, offsets: List[int], levels: List[int], start: int, end: int, min_level: int) -> List[Tuple[int, int]]:
+        """Диапазоны байт внутри [start, end), которые нужно прочитать, от новых к старым"""
+        bounds = offsets + [size]
+        blocks = [(offsets[k], bounds[k + 1], levels[k]) for k in range(len(offsets))]
+        if not offsets or offsets[0] > 0:
+            # начало файла до первой метки: уровень записей неизвестен
+            blocks.insert(0, (0, offsets[0] if offsets else size, 0))
+        ranges: List[Tuple[int, int]] = []
+        for lo, hi, level in reversed(blocks):
+            lo, hi = max(lo, start), min(hi, end)
+            if lo >= hi or level < min_level:
+                continue
+            if ranges and ranges[-1][0] == hi:
+                ranges[-1] = (lo, ranges[-1][1])
+            else:
+                ranges.append((lo, hi))
+        return ranges
+
+    def search(self, flt: LogFilter, limit: int) -> List[str]:
+        """Последние limit строк, подходящих под фильтр"""
+        found: List[str] = []  # от новых к старым
+        for path in reversed(self.files()):
+            try:
+                size, stamps, offsets, levels = self._update(path)
+            except FileNotFoundError:
+                continue  # файл ушёл при ротации
+            start, end, older = 0, size, True
+            if stamps:
+                if flt.until:
+                    if stamps[0] > flt.until:
+                        continue  # весь файл новее until, более старые файлы ещё могут подойти
+                    j = bisect.bisect_right(stamps, flt.until)
+                    end = offsets[j] if j < len(offsets) else size
+                if flt.since:
+                    i = bisect.bisect_left(stamps, flt.since) - 1
+                    if i >= 0:
+                        # since внутри этого файла: более старые файлы целиком раньше since
+                        start, older = offsets[i], False
+            done = False
+            for lo, hi in self._ranges(size, offsets, levels, start, end, flt.min_level):
+                if self._scan(path, lo, hi, flt, found, limit):
+                    done = True
+                    break
+            if done or not older:
+                break
+        found.reverse()
+        return found
+
+    def _scan(self, path: str, start: int, end: int, flt: LogFilter, found: List[str], limit: int) -> bool:
+        """
+        Сканирует диапазон [start, end) файла от конца к началу, дописывая
+        совпадения в found; True — набрано limit строк или дошли до since.
+        """
+        # строки без метки (traceback) наследуют время и уровень предыдущей записи,
+        # поэтому при обратном чтении они копятся до строки с меткой
+        pending: List[bytes] = []
+        key = flt.stream_bytes
+        for raw in reverse_lines(path, start, end):
+            m = LINE_RE.match(raw)
+            if not m:
+                if key is None or key in raw:
+                    pending.append(raw)
+                continue
+            ts, level = m.group(1).decode(), m.group(2).decode()
+            if flt.since and ts < flt.since:
+                return True
+            for item in pending:
+                line = item.decode("utf-8", errors="replace")
+                if flt.match(ts, level, line):
+                    found.append(line)
+            pending.clear()
+            if key is not None and key not in raw:
+                continue
+            line = raw.decode("utf-8", errors="replace")
+            if flt.match(ts, level, line):
+                found.append(line)
+            if len(found) >= limit:
+                del found[limit:]
+                return True
+        # начало файла без метки — продолжение записи из более старого файла
+        for item in pending:
+            line = item.decode("utf-8", errors="replace")
+            if flt.match(None, None, line):
+                found.append(line)
+        if len(found) >= limit:
+            del found[limit:]
+            return True
+        return False
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Хранит последние capacity записей лога в памяти и будит подписчиков
+    режима follow. Запись может прийти из любого потока, поэтому
+    уведомление передаётся в event loop через call_soon_threadsafe.
+    """
+
+    def __init__(self, capacity: int = 5000):
+        super().__init__()
+        self.records: Deque[Tuple[int, str, str, str]] = collections.deque(maxlen=capacity)
+        self.seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        ts = line[:23]
+        with self.lock:
+            self.seq += 1
+            self.records.append((self.seq, ts, record.levelname, line))
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self._event is not None:
+            self._event.set()
+            self._event = asyncio.Event()
+
+    async def wait(self, seq: int, timeout: float):
+        """
+        Ждёт записей новее seq не дольше timeout секунд. Записи, пришедшие,
+        пока подписчик отдавал предыдущие (событие уже сработало и заменено),
+        видны по номеру — тогда ожидания нет.
+        """
+        event = self._event
+        if self.seq > seq:
+            return
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def since(self, seq: int) -> Tuple[int, List[Tuple[int, str, str, str]]]:
+        """Записи с номером больше seq; первым элементом — номер последней записи"""
+        with self.lock:
+            if not self.records or self.records[-1][0] <= seq:
+                return self.seq, []
+            first = self.records[0][0]
+            items = list(self.records)[max(0, seq + 1 - first):]
+            return self.seq, items
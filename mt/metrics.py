@@ -0,0 +1,201 @@
+import bisect
+import math
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (метки, значение) — одна строка метрики
+Sample = Tuple[Dict[str, str], float]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_family(name: str, kind: str, help_text: str, samples: Iterable[Sample]) -> List[str]:
+    """Строки одной метрики в текстовом формате Prometheus"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(format_sample(name, labels, value))
+    return lines
+
+
+def format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        inner = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+        return f"{name}{{{inner}}} {format_value(value)}"
+    return f"{name} {format_value(value)}"
+
+
+SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})?\s+(.*)$")
+
+
+def merge_exposition(texts: Dict[str, str], label: str = "node") -> str:
+    """
+    Сливает метрики нескольких узлов в один ответ: HELP/TYPE каждого семейства
+    выводятся один раз, к каждой строке добавляется метка label с именем узла.
+    """
+    families: Dict[str, List[str]] = {}
+    headers: Dict[str, List[str]] = {}
+    for node, text in texts.items():
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(None, 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    heads = headers.setdefault(parts[2], [])
+                    if not any(h.split(None, 2)[1] == parts[1] for h in heads):
+                        heads.append(line)
+                    families.setdefault(parts[2], [])
+                continue
+            m = SAMPLE_RE.match(line)
+            if m is None:
+                continue
+            name, _, labels, value = m.groups()
+            inner = f'{label}="{escape_label(node)}"' + (f",{labels}" if labels else "")
+            family = next((f for f in (name, re.sub(r"_(bucket|sum|count)$", "", name)) if f in headers), name)
+            families.setdefault(family, []).append(f"{name}{{{inner}}} {value}")
+    lines: List[str] = []
+    for family, samples in families.items():
+        lines.extend(headers.get(family, []))
+        lines.extend(samples)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        samples = ((dict(zip(self.labelnames, k)), v) for k, v in self.values.items())
+        return render_family(self.name, "counter", self.help, samples)
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        self.values[labels] = value
+
+    def collect(self) -> List[str]:
+        samples = ((dict(zip(self.labelnames, k)), v) for k, v in self.values.items())
+        return render_family(self.name, "gauge", self.help, samples)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; observe — O(log корзин), без выделения памяти"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки → [счётчики по корзинам..., сумма, количество]
+        self.values: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, row in self.values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                lines.append(format_sample(self.name + "_bucket", {**labels, "le": format_value(float(bound))}, cumulative))
+            lines.append(format_sample(self.name + "_bucket", {**labels, "le": "+Inf"}, row[-1]))
+            lines.append(format_sample(self.name + "_sum", labels, row[-2]))
+            lines.append(format_sample(self.name + "_count", labels, row[-1]))
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик для /metrics. Кроме обычных метрик принимает коллекторы —
+    функции, которые считают значения в момент запроса (состояние индекса
+    потоков, число процессов превью и т.п.) и возвращают готовые строки.
+    """
+
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self._add(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self._add(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self._add(Histogram(*args, **kwargs))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for collect in self.collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+
+class ByteRates:
+    """
+    Скорость приёма/отдачи по каждому потоку: прирост накопительных счётчиков
+    MediaMTX за последние window секунд (не реже одного обновления индекса).
+    Подключается как listener индекса потоков.
+    """
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self.rates: Dict[str, Tuple[float, float]] = {}  # ключ → (вход, выход), байт/с
+        self._base: Dict[str, Tuple[float, int, int]] = {}  # ключ → (время, вход, выход) начала окна
+
+    def on_refresh(self, old: Dict[str, dict], new: Dict[str, dict]):
+        now = time.monotonic()
+        for key in list(self._base):
+            if key not in new:
+                del self._base[key]
+                self.rates.pop(key, None)
+        for key, entry in new.items():
+            rx, tx = entry.get("bytes_received") or 0, entry.get("bytes_sent") or 0
+            base = self._base.get(key)
+            if base is None:
+                self._base[key] = (now, rx, tx)
+                continue
+            dt = now - base[0]
+            if dt < self.window:
+                continue
+            # счётчики сбрасываются при перезапуске пути — такой интервал считаем нулевым
+            self.rates[key] = (max(rx - base[1], 0) / dt, max(tx - base[2], 0) / dt)
+            self._base[key] = (now, rx, tx)
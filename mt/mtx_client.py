@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, List, Optional
+
+import httpx
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# последние сегменты пути API, после которых идёт имя пути MediaMTX
+API_ACTIONS = {"list", "get", "add", "patch", "replace", "delete", "kick"}
+
+
+def endpoint_label(path: str) -> str:
+    """Шаблон эндпоинта без имени пути и query: /config/paths/add/live/x → /config/paths/add"""
+    parts = []
+    for part in path.split("?", 1)[0].strip("/").split("/"):
+        parts.append(part)
+        if part in API_ACTIONS:
+            break
+    return "/" + "/".join(parts)
+
+
+class MediaMTXUnavailable(Exception):
+    """MediaMTX не отвечает: сетевая ошибка, таймаут или открыт circuit breaker"""
+
+
+class CircuitBreaker:
+    """
+    Простой circuit breaker:
+    - closed: запросы идут как обычно, считаются подряд идущие ошибки
+    - open: после failure_threshold ошибок запросы сразу отклоняются на reset_timeout секунд
+    - half-open: по истечении reset_timeout пропускается один пробный запрос
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def release(self):
+        """Снимает пробный запрос без результата (например, при отмене)"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"MediaMTX circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class MediaMTXClient:
+    """
+    Общий клиент HTTP API MediaMTX, живёт столько же, сколько приложение.
+    Держит пул keep-alive соединений, ставит таймауты на каждый вызов,
+    повторяет неудачные запросы с jitter и объединяет одинаковые GET,
+    которые выполняются одновременно, в один запрос к MediaMTX.
+    """
+
+    # статусы, при которых GET имеет смысл повторить
+    RETRY_STATUSES = {502, 503, 504}
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 2.0,
+        connect_timeout: float = 1.0,
+        retries: int = 2,
+        backoff: float = 0.1,
+        max_connections: int = 50,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight = SingleFlight()
+        # вызываются после каждой попытки как observer(method, path, status, seconds);
+        # status — код ответа или имя сетевой ошибки
+        self.observers: List[Callable[[str, str, str, float], None]] = []
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self._transport,
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, path: str, timeout: Optional[float] = None) -> httpx.Response:
+        """GET с объединением одинаковых одновременных запросов (single-flight)"""
+        return await self._inflight.do(path, lambda: self._request("GET", path, timeout=timeout, idempotent=True))
+
+    async def post(self, path: str, json=None, timeout: Optional[float] = None) -> httpx.Response:
+        return await self._request("POST", path, json=json, timeout=timeout)
+
+    async def patch(self, path: str, json=None, timeout: Optional[float] = None) -> httpx.Response:
+        return await self._request("PATCH", path, json=json, timeout=timeout)
+
+    async def delete(self, path: str, timeout: Optional[float] = None) -> httpx.Response:
+        return await self._request("DELETE", path, timeout=timeout)
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json=None,
+        timeout: Optional[float] = None,
+        idempotent: bool = False,
+    ) -> httpx.Response:
+        if self._client is None:
+            await self.start()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise MediaMTXUnavailable(f"circuit {self.breaker.state}, {method} {path} rejected")
+            started = time.perf_counter()
+            try:
+                resp = await self._client.request(
+                    method, path, json=json,
+                    timeout=timeout if timeout is not None else self.timeout,
+                )
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except httpx.TransportError as e:
+                self._observe(method, path, type(e).__name__, started)
+                self.breaker.record_failure()
+                # неидемпотентные запросы повторяем только если соединение не было установлено
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= self.retries:
+                    logger.error(f"MediaMTX {method} {path} failed: {e!r}")
+                    raise MediaMTXUnavailable(str(e) or type(e).__name__) from e
+            else:
+                self._observe(method, path, str(resp.status_code), started)
+                # 500 MediaMTX отдаёт и на ошибки в запросе, поэтому сбоем считаем только 502/503/504
+                if resp.status_code in self.RETRY_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if not (idempotent and resp.status_code in self.RETRY_STATUSES and attempt < self.retries):
+                    return resp
+            attempt += 1
+            # экспоненциальная задержка с full jitter
+            await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _observe(self, method: str, path: str, status: str, started: float):
+        elapsed = time.perf_counter() - started
+        for observer in self.observers:
+            observer(method, path, status, elapsed)
@@ -0,0 +1,358 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+from mtx_client import MediaMTXClient, MediaMTXUnavailable
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# поля конфигурации пути, которые переносятся на другой узел при перебалансировке
+CONF_FIELDS = ("source", "sourceOnDemand")
+
+
+class NodeSpec(NamedTuple):
+    name: str
+    api_url: str      # http://host:9997 (без /v3)
+    rtsp_base: str    # rtsp://host:8554
+    metrics_url: str  # http://host:9998
+
+
+def parse_nodes(spec: str) -> List[NodeSpec]:
+    """
+    Разбирает список узлов MediaMTX: элементы через запятую вида
+    [имя=]http://host:9997[|rtsp://host:8554[|http://host:9998]].
+    Адреса RTSP и метрик по умолчанию — тот же хост на портах 8554 и 9998.
+    """
+    nodes = []
+    for raw in spec.split(","):
+        raw = raw.strip()
+        if not raw:
+            continue
+        name, sep, rest = raw.partition("=")
+        if not sep or "://" in name:
+            name, rest = "", raw
+        parts = [p.strip().rstrip("/") for p in rest.split("|")]
+        api_url = parts[0]
+        u = urlsplit(api_url)
+        if not u.scheme or not u.hostname:
+            raise ValueError(f"Неверный адрес узла MediaMTX: {raw}")
+        rtsp_base = parts[1] if len(parts) > 1 and parts[1] else f"rtsp://{u.hostname}:8554"
+        metrics_url = parts[2] if len(parts) > 2 and parts[2] else f"{u.scheme}://{u.hostname}:9998"
+        nodes.append(NodeSpec(name or u.netloc, api_url, rtsp_base, metrics_url))
+    if len({n.name for n in nodes}) != len(nodes):
+        raise ValueError("Имена узлов MediaMTX повторяются")
+    return nodes
+
+
+class MediaMTXNode:
+    """Один узел MediaMTX: клиент API, адрес для читателей RTSP и последнее известное состояние"""
+
+    def __init__(
+        self,
+        name: str,
+        client: MediaMTXClient,
+        rtsp_base: str,
+        metrics_client: Optional[MediaMTXClient] = None,
+    ):
+        self.name = name
+        self.client = client
+        self.rtsp_base = rtsp_base.rstrip("/")
+        self.metrics_client = metrics_client
+        self.healthy = True
+        self.failures = 0                   # неудачных проверок подряд
+        self.last_error: Optional[str] = None
+        self.configs: Dict[str, dict] = {}  # имя пути → конфигурация с последней проверки
+        self.readers = 0                    # читателей по последнему списку путей
+
+    def rtsp_url(self, path_name: str) -> str:
+        return f"{self.rtsp_base}/{path_name}"
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "circuit": self.client.breaker.state,
+            "paths": len(self.configs),
+            "readers": self.readers,
+            "rtsp_base": self.rtsp_base,
+            "last_error": self.last_error,
+        }
+
+
+class MediaMTXPool:
+    """
+    Пул узлов MediaMTX.
+    Новый путь размещается на узле по consistent hashing (по умолчанию) или на
+    наименее загруженном (путей + читателей); уже размещённый путь остаётся
+    на своём узле. Списки собираются со всех узлов одновременно, упавший узел
+    пропускается. Фоновая проверка раз в health_interval секунд обновляет
+    состояние узлов; узел считается упавшим после down_after неудачных
+    проверок подряд — одиночный таймаут не переносит пути и не обрывает
+    читателей. Пути упавшего узла заново регистрируются на живых,
+    а после возвращения узла дубликаты с него удаляются.
+    """
+
+    def __init__(
+        self,
+        nodes: List[MediaMTXNode],
+        placement: str = "hash",
+        health_interval: float = 5.0,
+        down_after: int = 3,
+        page_size: int = 1000,
+        replicas: int = 64,
+        rebalance_concurrency: int = 16,
+    ):
+        if not nodes:
+            raise ValueError("Нужен хотя бы один узел MediaMTX")
+        if placement not in ("hash", "least-load"):
+            raise ValueError(f"Неизвестная стратегия размещения: {placement}")
+        self.nodes: Dict[str, MediaMTXNode] = {n.name: n for n in nodes}
+        self.placement = placement
+        self.health_interval = health_interval
+        self.down_after = max(1, down_after)
+        self.page_size = page_size
+        self.rebalance_concurrency = rebalance_concurrency
+        self.assignments: Dict[str, str] = {}  # имя пути → имя узла
+        # кольцо consistent hashing: replicas виртуальных точек на узел
+        self._ring: List[Tuple[int, str]] = sorted(
+            (self._hash(f"{n.name}#{i}"), n.name) for n in nodes for i in range(replicas)
+        )
+        self._ring_keys = [h for h, _ in self._ring]
+        self._task: Optional[asyncio.Task] = None
+        self._checks = SingleFlight()  # идущие проверки по имени узла
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    @property
+    def healthy(self) -> List[MediaMTXNode]:
+        return [n for n in self.nodes.values() if n.healthy]
+
+    async def start(self):
+        for node in self.nodes.values():
+            await node.client.start()
+            if node.metrics_client is not None:
+                await node.metrics_client.start()
+        await self.check_all()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for node in self.nodes.values():
+            await node.client.close()
+            if node.metrics_client is not None:
+                await node.metrics_client.close()
+
+    # --- размещение ---
+
+    def node_of(self, path_name: str) -> Optional[MediaMTXNode]:
+        """Узел, на котором путь уже зарегистрирован (если известен)"""
+        name = self.assignments.get(path_name)
+        return self.nodes.get(name) if name else None
+
+    def load(self, node: MediaMTXNode) -> int:
+        paths = sum(1 for n in self.assignments.values() if n == node.name)
+        return paths + node.readers
+
+    def place(self, path_name: str, exclude: Tuple[str, ...] = ()) -> MediaMTXNode:
+        """Узел для пути: текущий, если он жив, иначе по стратегии размещения среди живых"""
+        node = self.node_of(path_name)
+        if node is not None and node.healthy and node.name not in exclude:
+            return node
+        candidates = [n for n in self.healthy if n.name not in exclude]
+        if not candidates:
+            raise MediaMTXUnavailable("нет доступных узлов MediaMTX")
+        if self.placement == "least-load":
+            return min(candidates, key=lambda n: (self.load(n), n.name))
+        allowed = {n.name for n in candidates}
+        start = bisect.bisect(self._ring_keys, self._hash(path_name))
+        for i in range(len(self._ring)):
+            name = self._ring[(start + i) % len(self._ring)][1]
+            if name in allowed:
+                return self.nodes[name]
+        return candidates[0]
+
+    def assign(self, path_name: str, node: MediaMTXNode, conf: Optional[dict] = None):
+        self.assignments[path_name] = node.name
+        if conf is not None:
+            node.configs[path_name] = {"name": path_name, **conf}
+
+    def unassign(self, path_name: str, node: MediaMTXNode):
+        node.configs.pop(path_name, None)
+        if self.assignments.get(path_name) == node.name:
+            del self.assignments[path_name]
+
+    def rtsp_url(self, path_name: str) -> str:
+        node = self.node_of(path_name)
+        if node is None:
+            node = self.place(path_name) if self.healthy else next(iter(self.nodes.values()))
+        return node.rtsp_url(path_name)
+
+    # --- чтение со всех узлов ---
+
+    async def fetch_node(self, node: MediaMTXNode, list_path: str) -> List[dict]:
+        """Все элементы списка с одного узла, по страницам"""
+        items, page = [], 0
+        while True:
+            resp = await node.client.get(f"{list_path}?itemsPerPage={self.page_size}&page={page}")
+            if resp.status_code != 200:
+                raise MediaMTXUnavailable(f"{node.name}: list error {resp.status_code}")
+            data = resp.json()
+            items.extend(data.get("items") or [])
+            page += 1
+            if page >= data.get("pageCount", 1):
+                return items
+
+    async def fetch_all(self, list_path: str) -> List[dict]:
+        """
+        Список со всех живых узлов одновременно; у каждого элемента поле node.
+        Если путь есть на нескольких узлах, остаётся запись с назначенного узла.
+        """
+        nodes = self.healthy or list(self.nodes.values())
+        results = await asyncio.gather(*(self.fetch_node(n, list_path) for n in nodes), return_exceptions=True)
+        merged: Dict[str, dict] = {}
+        failed = 0
+        for node, result in zip(nodes, results):
+            if isinstance(result, BaseException):
+                failed += 1
+                # узел помечается упавшим только фоновой проверкой (down_after раз подряд), а не по ошибке списка
+                logger.warning(f"MediaMTX node {node.name} list failed: {result!r}")
+                continue
+            if result and "readers" in result[0]:
+                node.readers = sum(len(itm.get("readers") or []) for itm in result)
+            for itm in result:
+                name = itm.get("name")
+                if name in merged and self.assignments.get(name) != node.name:
+                    continue
+                merged[name] = {**itm, "node": node.name}
+        if failed == len(nodes):
+            raise MediaMTXUnavailable("ни один узел MediaMTX не ответил")
+        return list(merged.values())
+
+    async def get_path(self, path_name: str) -> Optional[dict]:
+        """Состояние пути (/paths/get): сначала с назначенного узла, иначе опрос всех живых"""
+        node = self.node_of(path_name)
+        nodes = [node] if node is not None and node.healthy else (self.healthy or list(self.nodes.values()))
+
+        async def one(n: MediaMTXNode):
+            resp = await n.client.get(f"/paths/get/{path_name}")
+            if resp.status_code == 200:
+                return {**resp.json(), "node": n.name}
+            if resp.status_code != 404:
+                logger.error(f"MediaMTX {n.name} GET error {resp.status_code}")
+            return None
+
+        results = await asyncio.gather(*(one(n) for n in nodes), return_exceptions=True)
+        found = [r for r in results if isinstance(r, dict)]
+        if found:
+            return found[0]
+        if all(isinstance(r, MediaMTXUnavailable) for r in results):
+            raise MediaMTXUnavailable(f"узлы MediaMTX не ответили на {path_name}")
+        return None
+
+    # --- проверка узлов и перебалансировка ---
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(n) for n in self.nodes.values()))
+        await self._dedupe()
+
+    async def check(self, node: MediaMTXNode):
+        # одновременные проверки одного узла (фон и старт пула) объединяются
+        await self._checks.do(node.name, lambda: self._check(node))
+
+    async def _check(self, node: MediaMTXNode):
+        try:
+            items = await self.fetch_node(node, "/config/paths/list")
+        except MediaMTXUnavailable as e:
+            node.failures += 1
+            node.last_error = str(e) or type(e).__name__
+            if node.failures >= self.down_after:
+                self._mark_down(node)
+            else:
+                logger.warning(f"MediaMTX node {node.name} check failed ({node.failures}/{self.down_after}): {node.last_error}")
+            return
+        node.configs = {c["name"]: c for c in items if c.get("name")}
+        if not node.healthy:
+            logger.info(f"MediaMTX node {node.name} is back ({len(node.configs)} paths)")
+        node.healthy = True
+        node.failures = 0
+        node.last_error = None
+        for path_name in node.configs:
+            current = self.node_of(path_name)
+            if current is None or not current.healthy:
+                self.assignments[path_name] = node.name
+
+    def _mark_down(self, node: MediaMTXNode):
+        if not node.healthy:
+            return
+        node.healthy = False
+        logger.warning(f"MediaMTX node {node.name} is down: {node.last_error}")
+        task = asyncio.ensure_future(self.rebalance(node))
+        task.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def rebalance(self, failed: MediaMTXNode):
+        """Регистрирует пути упавшего узла на живых узлах"""
+        moved = [(p, c) for p, c in failed.configs.items() if self.assignments.get(p) == failed.name]
+        if not moved or not self.healthy:
+            return
+        logger.warning(f"Rebalancing {len(moved)} paths from MediaMTX node {failed.name}")
+        sem = asyncio.Semaphore(self.rebalance_concurrency)
+
+        async def move(path_name: str, conf: dict):
+            async with sem:
+                try:
+                    target = self.place(path_name, exclude=(failed.name,))
+                    payload = {k: conf[k] for k in CONF_FIELDS if k in conf}
+                    resp = await target.client.post(f"/config/paths/add/{path_name}", json=payload)
+                except MediaMTXUnavailable as e:
+                    logger.error(f"Rebalance of {path_name} failed: {e}")
+                    return
+            # 400 — путь на целевом узле уже есть
+            if resp.status_code in (200, 400):
+                self.assign(path_name, target, payload)
+            else:
+                logger.error(f"Rebalance of {path_name} to {target.name} failed: {resp.status_code} {resp.text}")
+
+        await asyncio.gather(*(move(p, c) for p, c in moved))
+
+    async def _dedupe(self):
+        """Удаляет с узлов пути, которые за время их недоступности переехали на другой узел"""
+        stale = [
+            (node, path_name)
+            for node in self.healthy
+            for path_name in list(node.configs)
+            if self.assignments.get(path_name) not in (None, node.name)
+            and self.nodes[self.assignments[path_name]].healthy
+        ]
+        for node, path_name in stale:
+            try:
+                resp = await node.client.delete(f"/config/paths/delete/{path_name}")
+            except MediaMTXUnavailable as e:
+                logger.error(f"Stale path cleanup on {node.name} failed: {e}")
+                continue
+            if resp.status_code in (200, 404):
+                node.configs.pop(path_name, None)
+                logger.info(f"Removed stale path {path_name} from MediaMTX node {node.name}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"MediaMTX health check failed: {e!r}")
@@ -0,0 +1,310 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET = 188
+TS_SYNC = 0x47
+READ_CHUNK = 64 * TS_PACKET
+
+# stream_type видеопотоков в PMT (MPEG-1/2, MPEG-4, H.264, HEVC)
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1B, 0x24}
+
+
+def _section_payload(pkt: bytes) -> Optional[bytes]:
+    """Полезная нагрузка PSI-секции (PAT/PMT) из начального TS-пакета"""
+    if not pkt[1] & 0x40:
+        return None
+    afc = (pkt[3] >> 4) & 0x3
+    pos = 4
+    if afc in (2, 3):
+        pos += 1 + pkt[4]
+    if afc == 2 or pos >= TS_PACKET:
+        return None
+    pos += 1 + pkt[pos]  # pointer_field
+    return pkt[pos:]
+
+
+def parse_pat(pkt: bytes) -> Set[int]:
+    """PID-ы PMT из пакета PAT"""
+    sec = _section_payload(pkt)
+    if not sec or len(sec) < 8:
+        return set()
+    length = ((sec[1] & 0x0F) << 8) | sec[2]
+    end = min(3 + length - 4, len(sec))  # без CRC32
+    pids = set()
+    for i in range(8, end - 3, 4):
+        program = (sec[i] << 8) | sec[i + 1]
+        if program != 0:
+            pids.add(((sec[i + 2] & 0x1F) << 8) | sec[i + 3])
+    return pids
+
+
+def parse_pmt_video_pid(pkt: bytes) -> Optional[int]:
+    """PID первого видеопотока из пакета PMT"""
+    sec = _section_payload(pkt)
+    if not sec or len(sec) < 12:
+        return None
+    length = ((sec[1] & 0x0F) << 8) | sec[2]
+    end = min(3 + length - 4, len(sec))
+    pos = 12 + (((sec[10] & 0x0F) << 8) | sec[11])
+    while pos + 5 <= end:
+        stream_type = sec[pos]
+        pid = ((sec[pos + 1] & 0x1F) << 8) | sec[pos + 2]
+        if stream_type in VIDEO_STREAM_TYPES:
+            return pid
+        pos += 5 + (((sec[pos + 3] & 0x0F) << 8) | sec[pos + 4])
+    return None
+
+
+def is_random_access(pkt: bytes) -> bool:
+    """Флаг random_access_indicator в adaptation field — начало ключевого кадра"""
+    afc = (pkt[3] >> 4) & 0x3
+    return afc in (2, 3) and pkt[4] > 0 and bool(pkt[5] & 0x40)
+
+
+class PreviewSession:
+    """
+    Одно RTSP-подключение ffmpeg к потоку, сколько бы клиентов ни смотрело превью.
+    Выход ffmpeg (MPEG-TS) режется на GOP по ключевым кадрам и хранится в
+    кольцевом буфере последних buffer_seconds секунд. Новый клиент сразу
+    получает PAT/PMT и текущий GOP с ключевого кадра, затем живые данные.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        rtsp_url: str,
+        buffer_seconds: float,
+        max_buffer_bytes: int,
+        queue_size: int,
+        idle_timeout: float,
+        on_close: Callable[["PreviewSession"], None],
+    ):
+        self.key = key
+        self.rtsp_url = rtsp_url
+        self.buffer_seconds = buffer_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.on_close = on_close
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.clients: Set[asyncio.Queue] = set()
+        # (время начала, данные GOP); последний элемент дописывается
+        self.gops: Deque[Tuple[float, bytearray]] = collections.deque()
+        self.buffered_bytes = 0
+        self.pat: Optional[bytes] = None
+        self.pmt: Optional[bytes] = None
+        self._pmt_pids: Set[int] = set()
+        self._video_pid: Optional[int] = None
+        self._tasks: List[asyncio.Task] = []
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self.closed = False
+
+    async def start(self):
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-rtsp_transport", "tcp",
+            "-i", self.rtsp_url,
+            "-c", "copy",
+            "-f", "mpegts",
+            "pipe:1",
+        ]
+        self.proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        logger.info(f"Preview ingest started for {self.key} (pid {self.proc.pid})")
+        self._tasks = [
+            asyncio.create_task(self._read()),
+            asyncio.create_task(self._drain_stderr()),
+        ]
+        self._schedule_idle()
+
+    def keyframe_data(self, latest_only: bool = True) -> bytes:
+        """PAT/PMT и буфер с ключевого кадра: последний GOP или весь буфер"""
+        if not self.gops:
+            return b""
+        gops = [self.gops[-1]] if latest_only else list(self.gops)
+        return (self.pat or b"") + (self.pmt or b"") + b"".join(bytes(g) for _, g in gops)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        initial = self.keyframe_data()
+        if initial:
+            queue.put_nowait(initial)
+        if self.closed:
+            # ffmpeg завершился между session() и subscribe(): клиент получает уже закрытую очередь
+            queue.put_nowait(None)
+            return queue
+        self.clients.add(queue)
+        self._cancel_idle()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.clients.discard(queue)
+        if not self.clients:
+            self._schedule_idle()
+
+    def _schedule_idle(self):
+        self._cancel_idle()
+        if not self.closed:
+            loop = asyncio.get_running_loop()
+            self._idle_handle = loop.call_later(self.idle_timeout, lambda: asyncio.ensure_future(self._on_idle()))
+
+    def _cancel_idle(self):
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    async def _on_idle(self):
+        if not self.clients:
+            logger.info(f"Preview ingest idle, stopping: {self.key}")
+            await self.close()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._cancel_idle()
+        self.on_close(self)
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.terminate()
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+                await self.proc.wait()
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        for queue in list(self.clients):
+            self._disconnect(queue)
+
+    def _disconnect(self, queue: asyncio.Queue):
+        self.clients.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _drain_stderr(self):
+        async for line in self.proc.stderr:
+            logger.warning(f"Preview ffmpeg [{self.key}]: {line.decode(errors='ignore').rstrip()}")
+
+    async def _read(self):
+        pending = b""
+        try:
+            while True:
+                chunk = await self.proc.stdout.read(READ_CHUNK)
+                if not chunk:
+                    break
+                data = pending + chunk
+                usable = len(data) - len(data) % TS_PACKET
+                pending = data[usable:]
+                self._feed(memoryview(data)[:usable])
+        finally:
+            logger.info(f"Preview ingest ended for {self.key}")
+            asyncio.ensure_future(self.close())
+
+    def _feed(self, data: memoryview):
+        # делим блок по пакетам с ключевыми кадрами: данные до него дописываются в текущий GOP
+        seg_start = 0
+        for off in range(0, len(data), TS_PACKET):
+            pkt = data[off:off + TS_PACKET]
+            if pkt[0] != TS_SYNC:
+                continue
+            pid = ((pkt[1] & 0x1F) << 8) | pkt[2]
+            if pid == 0:
+                self.pat = bytes(pkt)
+                self._pmt_pids = parse_pat(self.pat)
+            elif pid in self._pmt_pids:
+                self.pmt = bytes(pkt)
+                video_pid = parse_pmt_video_pid(self.pmt)
+                if video_pid is not None:
+                    self._video_pid = video_pid
+            elif pid == self._video_pid and pkt[1] & 0x40 and is_random_access(pkt):
+                self._append(data[seg_start:off])
+                self._new_gop()
+                seg_start = off
+        self._append(data[seg_start:])
+
+    def _new_gop(self):
+        now = time.monotonic()
+        self.gops.append((now, bytearray()))
+        # оставляем последние buffer_seconds секунд, но всегда хотя бы текущий GOP
+        while len(self.gops) > 1 and (
+            now - self.gops[1][0] >= self.buffer_seconds or self.buffered_bytes > self.max_buffer_bytes
+        ):
+            _, old = self.gops.popleft()
+            self.buffered_bytes -= len(old)
+
+    def _append(self, segment: memoryview):
+        # до первого ключевого кадра данные не отдаём: декодер их всё равно не покажет
+        if not segment or not self.gops:
+            return
+        # слишком длинный GOP дальше не копим (начало с ключевым кадром остаётся), но клиентам отдаём
+        if self.buffered_bytes + len(segment) <= self.max_buffer_bytes or len(self.gops) > 1:
+            self.gops[-1][1].extend(segment)
+            self.buffered_bytes += len(segment)
+        payload = bytes(segment)
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping slow preview client for {self.key}")
+                self._disconnect(queue)
+                if not self.clients:
+                    self._schedule_idle()
+
+
+class PreviewEngine:
+    """Не больше одного ingest-процесса на ключ потока, общий для всех клиентов превью"""
+
+    def __init__(
+        self,
+        rtsp_url_for: Callable[[str], str],
+        buffer_seconds: float = 4.0,
+        max_buffer_bytes: int = 8 * 1024 * 1024,
+        queue_size: int = 256,
+        idle_timeout: float = 15.0,
+    ):
+        self.rtsp_url_for = rtsp_url_for
+        self.buffer_seconds = buffer_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, PreviewSession] = {}
+        self._starting = SingleFlight()
+
+    @property
+    def process_count(self) -> int:
+        return sum(1 for s in self.sessions.values() if s.proc and s.proc.returncode is None)
+
+    async def session(self, key: str) -> PreviewSession:
+        """Возвращает работающую сессию для потока, запуская ingest при необходимости"""
+        session = self.sessions.get(key)
+        if session is not None and not session.closed:
+            return session
+        return await self._starting.do(key, lambda: self._start(key))
+
+    async def _start(self, key: str) -> PreviewSession:
+        session = PreviewSession(
+            key, self.rtsp_url_for(key),
+            self.buffer_seconds, self.max_buffer_bytes, self.queue_size, self.idle_timeout,
+            on_close=self._forget,
+        )
+        await session.start()
+        self.sessions[key] = session
+        return session
+
+    def _forget(self, session: PreviewSession):
+        if self.sessions.get(session.key) is session:
+            del self.sessions[session.key]
+
+    async def close(self):
+        await asyncio.gather(*(s.close() for s in list(self.sessions.values())))
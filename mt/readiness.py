@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+def is_ready(entry: Optional[dict]) -> bool:
+    """Поток готов к подключению: MediaMTX отметил путь ready и уже знает его дорожки"""
+    return bool(entry) and entry.get("status") == "running" and bool(entry.get("tracks"))
+
+
+async def rtsp_describe(url: str, timeout: float) -> bool:
+    """
+    RTSP DESCRIBE к MediaMTX. Для пути с sourceOnDemand это запускает захват
+    источника, а ответ приходит, когда источник готов; медиаданные не передаются.
+    """
+    u = urlsplit(url)
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(u.hostname, u.port or 554), timeout)
+        writer.write(f"DESCRIBE {url} RTSP/1.0\r\nCSeq: 1\r\nAccept: application/sdp\r\n\r\n".encode())
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        return b" 200 " in status
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.warning(f"RTSP DESCRIBE {url} failed: {e!r}")
+        return False
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+class ReadinessWatcher:
+    """
+    Общий наблюдатель готовности потоков для /stream/convert?wait_ready и
+    /streams/{key}/ready. Клиенты не опрашивают MediaMTX сами: все ожидания
+    разрешаются из listener индекса потоков, а пока есть ожидающие, индекс
+    обновляется чаще (раз в poll_interval секунд). Для путей с sourceOnDemand
+    один DESCRIBE на путь (kick) заставляет MediaMTX сразу забрать источник.
+    """
+
+    def __init__(
+        self,
+        request_refresh: Callable[[], None],
+        rtsp_url_for: Callable[[str], str],
+        poll_interval: float = 0.2,
+        kick: Callable[[str, float], Awaitable[bool]] = rtsp_describe,
+    ):
+        self.request_refresh = request_refresh
+        self.rtsp_url_for = rtsp_url_for
+        self.poll_interval = poll_interval
+        self.kick = kick
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self._kicks: Dict[str, asyncio.Task] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    def on_refresh(self, old: Dict[str, dict], new: Dict[str, dict]):
+        for key in list(self.waiters):
+            entry = new.get(key)
+            if is_ready(entry):
+                for fut in self.waiters.pop(key):
+                    if not fut.done():
+                        fut.set_result(entry)
+
+    async def wait(self, key: str, timeout: float, current: Optional[dict] = None, on_demand: bool = True) -> Optional[dict]:
+        """Запись индекса, как только поток готов, или None по истечении timeout"""
+        if is_ready(current):
+            return current
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.waiters.setdefault(key, []).append(fut)
+        if on_demand and key not in self._kicks:
+            task = asyncio.create_task(self.kick(self.rtsp_url_for(key), timeout))
+            self._kicks[key] = task
+            task.add_done_callback(lambda t: self._kick_done(key, t))
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        self.request_refresh()
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiting = self.waiters.get(key)
+            if waiting is not None and fut in waiting:
+                waiting.remove(fut)
+                if not waiting:
+                    del self.waiters[key]
+
+    def _kick_done(self, key: str, task: asyncio.Task):
+        self._kicks.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is None and task.result():
+            # источник уже отдал SDP — не ждём следующего планового обновления индекса
+            self.request_refresh()
+
+    async def _poll(self):
+        while self.waiters:
+            await asyncio.sleep(self.poll_interval)
+            self.request_refresh()
+
+    async def close(self):
+        for task in [self._poller, *self._kicks.values()]:
+            if task is not None:
+                task.cancel()
+        for futures in self.waiters.values():
+            for fut in futures:
+                if not fut.done():
+                    fut.cancel()
+        self.waiters.clear()
+
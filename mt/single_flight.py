@@ -0,0 +1,38 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов: первый вызов с ключом
+    запускает задачу, остальные ждут её результат. Ожидание идёт через
+    shield — отмена одного ожидающего (клиент отключился) не отменяет
+    общую задачу. Ошибка задачи помечается полученной, даже если
+    ожидающих не осталось, чтобы asyncio не писал "exception never retrieved".
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, start: Callable[[], Awaitable[T]]) -> T:
+        """Результат задачи start() для key; если такая задача уже идёт — ждём её"""
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(start())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(fut)
+
+    def _done(self, key: Hashable, fut: asyncio.Future):
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if not fut.cancelled():
+            fut.exception()
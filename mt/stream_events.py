@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, dict]
+
+
+def diff_entries(old: Dict[str, dict], new: Dict[str, dict]) -> List[Event]:
+    """
+    Сравнивает два снимка индекса и возвращает изменения:
+    added / removed — поток появился или пропал,
+    status — переход ready/not ready,
+    readers — изменилось число читателей.
+    """
+    events: List[Event] = []
+    for key, entry in new.items():
+        prev = old.get(key)
+        if prev is None:
+            events.append(("added", entry))
+            continue
+        if prev["status"] != entry["status"]:
+            events.append(("status", {
+                "stream_key": key,
+                "status": entry["status"],
+                "ready_time": entry["ready_time"],
+                "tracks": entry["tracks"],
+            }))
+        if prev["readers_count"] != entry["readers_count"] or prev["protocol_counts"] != entry["protocol_counts"]:
+            events.append(("readers", {
+                "stream_key": key,
+                "readers_count": entry["readers_count"],
+                "protocol_counts": entry["protocol_counts"],
+            }))
+    for key in old.keys() - new.keys():
+        events.append(("removed", {"stream_key": key}))
+    return events
+
+
+def format_sse(event: str, data) -> str:
+    if isinstance(data, bytes):
+        payload = data.decode("utf-8")
+    else:
+        payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class Subscriber:
+    """Очередь событий одного клиента; None в очереди означает, что клиент отключён"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.evicted = False
+
+    async def get(self) -> Optional[Event]:
+        return await self.queue.get()
+
+
+class EventHub:
+    """
+    Рассылает изменения индекса потоков всем подписчикам.
+    Источник один — фоновое обновление StreamIndex, поэтому число клиентов
+    не влияет на нагрузку на MediaMTX. У каждого клиента своя ограниченная
+    очередь; кто не успевает её разбирать, отключается и переподключается
+    с новым снимком.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscriber] = set()
+
+    def subscribe(self) -> Subscriber:
+        sub = Subscriber(self.queue_size)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self.subscribers.discard(sub)
+
+    def on_refresh(self, old: Dict[str, dict], new: Dict[str, dict]):
+        if not self.subscribers:
+            return
+        events = diff_entries(old, new)
+        if events:
+            self.publish(events)
+
+    def publish(self, events: List[Event]):
+        for sub in list(self.subscribers):
+            try:
+                for event in events:
+                    sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._evict(sub)
+
+    def _evict(self, sub: Subscriber):
+        logger.warning("Evicting slow stream events subscriber")
+        self.subscribers.discard(sub)
+        sub.evicted = True
+        # освобождаем очередь, чтобы клиент сразу получил сигнал отключения
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
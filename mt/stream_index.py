@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def count_by(values, key: Callable) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for v in values:
+        k = key(v)
+        counts[k] = counts.get(k, 0) + 1
+    return counts
+
+
+def track_type(t) -> str:
+    if isinstance(t, dict):
+        return t.get("type") or "unknown"
+    if isinstance(t, str):
+        return t.split(":", 1)[0]
+    return "unknown"
+
+
+def build_entry(itm: dict) -> dict:
+    """Формирует запись о потоке из элемента MediaMTX /v3/paths/list"""
+    readers = itm.get("readers") or []
+    raw_tracks = itm.get("tracks") or []
+    return {
+        "stream_key": itm.get("name", "").split('/', 1)[-1],
+        "status": "running" if itm.get("ready") else "stopped",
+        "ready_time": itm.get("readyTime"),
+        "bytes_received": itm.get("bytesReceived"),
+        "bytes_sent": itm.get("bytesSent"),
+        "source": itm.get("source"),
+        "readers_count": len(readers),
+        "protocol_counts": count_by(readers, lambda r: r.get("protocol", "unknown")),
+        "tracks": raw_tracks,
+        "track_counts": count_by(raw_tracks, track_type),
+        "node": itm.get("node"),  # узел MediaMTX, проставляется пулом узлов
+    }
+
+
+class StreamIndex:
+    """
+    Индекс потоков в памяти.
+    Фоновая задача раз в interval секунд забирает список путей из MediaMTX,
+    строит записи по ключу потока и один раз сериализует ответ для /streams.
+    Обработчики читают готовый снимок; если снимок старше max_staleness
+    (например, фоновое обновление падает), он обновляется синхронно.
+    """
+
+    def __init__(
+        self,
+        fetch_items: Callable[[], Awaitable[List[dict]]],
+        interval: float = 1.0,
+        max_staleness: float = 5.0,
+    ):
+        self.fetch_items = fetch_items
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.entries: Dict[str, dict] = {}
+        self.body: bytes = b'{"streams": []}'
+        self.etag: str = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.updated_at: Optional[float] = None  # time.monotonic() последнего успешного обновления
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._refreshing = SingleFlight()
+        # вызываются после каждого обновления как listener(old_entries, new_entries)
+        self.listeners: List[Callable[[Dict[str, dict], Dict[str, dict]], None]] = []
+
+    @property
+    def age(self) -> float:
+        if self.updated_at is None:
+            return float("inf")
+        return time.monotonic() - self.updated_at
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_refresh(self):
+        """Просит фоновую задачу обновиться, не дожидаясь конца интервала"""
+        self._wakeup.set()
+
+    async def snapshot(self) -> "StreamIndex":
+        """Возвращает индекс, обновив его, если снимок устарел"""
+        if self.age > self.max_staleness:
+            await self.refresh()
+        return self
+
+    async def refresh(self):
+        # одновременные вызовы ждут одно и то же обновление
+        await self._refreshing.do(None, self._refresh)
+
+    async def _refresh(self):
+        items = await self.fetch_items()
+        entries = {}
+        for itm in items:
+            entry = build_entry(itm)
+            entries[entry["stream_key"]] = entry
+        body = json.dumps({"streams": list(entries.values())}, ensure_ascii=False).encode("utf-8")
+        old, self.entries = self.entries, entries
+        if body != self.body:
+            self.body = body
+            self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.updated_at = time.monotonic()
+        for listener in self.listeners:
+            try:
+                listener(old, entries)
+            except Exception as e:
+                logger.error(f"Stream index listener failed: {e!r}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Stream index refresh failed: {e!r}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
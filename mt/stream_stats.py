@@ -0,0 +1,143 @@
+import time
+from array import array
+from typing import Dict, List, Optional
+
+
+class StreamSeries:
+    """
+    Временной ряд одного потока в кольцевом буфере фиксированного размера.
+    Каждый столбец — отдельный array, память выделяется один раз:
+    capacity × (8 + 8 + 8 + 4) байт, сколько бы ни работал поток.
+    Хранятся накопительные счётчики MediaMTX, битрейт считается при запросе.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))        # время замера, unix-секунды
+        self.received = array("q", bytes(8 * capacity))  # bytesReceived
+        self.sent = array("q", bytes(8 * capacity))      # bytesSent
+        self.readers = array("i", bytes(4 * capacity))
+        self.head = 0   # куда пишется следующий замер
+        self.count = 0
+
+    def append(self, ts: float, received: int, sent: int, readers: int):
+        i = self.head
+        self.ts[i] = ts
+        self.received[i] = received
+        self.sent[i] = sent
+        self.readers[i] = readers
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _indices_since(self, start: float) -> List[int]:
+        """Индексы замеров не старше start, от старых к новым (обход с конца — только по окну)"""
+        out = []
+        i = self.head
+        for _ in range(self.count):
+            i = (i - 1) % self.capacity
+            if self.ts[i] < start:
+                out.append(i)  # последний замер до окна — база для первой разницы
+                break
+            out.append(i)
+        out.reverse()
+        return out
+
+    def query(self, window: float, step: float, now: Optional[float] = None) -> dict:
+        """
+        Ряд за последние window секунд с шагом step: битрейт приёма/отдачи
+        (бит/с, по приросту счётчиков за шаг) и число читателей (среднее и
+        максимум за шаг). t — конец шага; шаг без замеров отдаётся как null.
+        """
+        now = time.time() if now is None else now
+        start = now - window
+        buckets = max(1, int(round(window / step)))
+        t = [round(start + (b + 1) * step, 3) for b in range(buckets)]
+        ingress: List[Optional[float]] = [None] * buckets
+        egress: List[Optional[float]] = [None] * buckets
+        readers_avg: List[Optional[float]] = [None] * buckets
+        readers_max: List[Optional[int]] = [None] * buckets
+
+        prev = None
+        # накопление по текущему шагу: первый и последний замер, сумма и максимум читателей
+        cur_bucket, first, last, r_sum, r_n, r_max = -1, None, None, 0, 0, 0
+
+        def flush():
+            b = cur_bucket
+            if b < 0 or last is None:
+                return
+            readers_avg[b] = round(r_sum / r_n, 2)
+            readers_max[b] = r_max
+            base = prev if prev is not None else first
+            dt = self.ts[last] - self.ts[base]
+            if dt > 0:
+                rx = self.received[last] - self.received[base]
+                tx = self.sent[last] - self.sent[base]
+                # счётчики обнуляются при перезапуске пути — такой шаг без значения
+                ingress[b] = round(rx * 8 / dt, 1) if rx >= 0 else None
+                egress[b] = round(tx * 8 / dt, 1) if tx >= 0 else None
+
+        for i in self._indices_since(start):
+            ts = self.ts[i]
+            if ts < start:
+                prev = i
+                continue
+            b = min(int((ts - start) / step), buckets - 1)
+            if b != cur_bucket:
+                flush()
+                if last is not None:
+                    prev = last
+                cur_bucket, first, last, r_sum, r_n, r_max = b, i, None, 0, 0, 0
+            last = i
+            r_sum += self.readers[i]
+            r_n += 1
+            r_max = max(r_max, self.readers[i])
+        flush()
+
+        return {
+            "t": t,
+            "ingress_bps": ingress,
+            "egress_bps": egress,
+            "readers_avg": readers_avg,
+            "readers_max": readers_max,
+        }
+
+
+class StreamStats:
+    """
+    Фоновый сбор статистики по всем потокам: listener индекса потоков
+    раз в interval секунд дописывает замер каждого потока в его StreamSeries.
+    Ряд удалённого из MediaMTX пути удаляется вместе с ним.
+    """
+
+    def __init__(self, interval: float = 2.0, capacity: int = 1800):
+        self.interval = interval
+        self.capacity = capacity
+        self.series: Dict[str, StreamSeries] = {}
+        self._last: Optional[float] = None
+
+    @property
+    def retention(self) -> float:
+        """Сколько секунд истории помещается в буфер"""
+        return self.interval * self.capacity
+
+    def on_refresh(self, old: Dict[str, dict], new: Dict[str, dict]):
+        now = time.monotonic()
+        # небольшой допуск: обновления индекса приходят не ровно по сетке
+        if self._last is not None and now - self._last < self.interval * 0.9:
+            return
+        self._last = now
+        ts = time.time()
+        for key in list(self.series):
+            if key not in new:
+                del self.series[key]
+        for key, entry in new.items():
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = StreamSeries(self.capacity)
+            series.append(
+                ts,
+                entry.get("bytes_received") or 0,
+                entry.get("bytes_sent") or 0,
+                entry.get("readers_count") or 0,
+            )
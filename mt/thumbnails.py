@@ -0,0 +1,119 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# формат → (кодек ffmpeg, MIME-тип)
+FORMATS = {
+    "jpeg": ("mjpeg", "image/jpeg"),
+    "webp": ("libwebp", "image/webp"),
+}
+
+
+class ThumbnailError(Exception):
+    """Не удалось получить кадр из потока"""
+
+
+async def render_thumbnail(
+    width: int,
+    fmt: str,
+    ts_data: Optional[bytes] = None,
+    rtsp_url: Optional[str] = None,
+    timeout: float = 10.0,
+) -> bytes:
+    """
+    Декодирует один кадр в JPEG/WebP шириной width.
+    Если есть MPEG-TS с ключевого кадра (буфер превью), кадр берётся из него,
+    иначе ffmpeg один раз подключается к потоку по RTSP.
+    """
+    codec, _ = FORMATS[fmt]
+    if ts_data:
+        source = ["-f", "mpegts", "-i", "pipe:0"]
+    else:
+        source = ["-rtsp_transport", "tcp", "-i", rtsp_url]
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        *source,
+        "-frames:v", "1",
+        "-vf", f"scale={width}:-2",
+        "-c:v", codec,
+        "-f", "image2pipe",
+        "pipe:1",
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if ts_data else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(ts_data), timeout=timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise ThumbnailError("timeout")
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0 or not out:
+        raise ThumbnailError(err.decode(errors="ignore").strip() or f"ffmpeg exit {proc.returncode}")
+    return out
+
+
+class ThumbnailCache:
+    """
+    LRU-кэш миниатюр с TTL и ограничением по суммарному размеру.
+    Генерация для одного ключа (поток, ширина, формат) идёт не чаще одного раза:
+    одновременные запросы ждут один и тот же процесс ffmpeg.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[str, int, str], Awaitable[bytes]],
+        ttl: float = 10.0,
+        max_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.render = render
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items: "collections.OrderedDict[Tuple[str, int, str], Tuple[float, bytes]]" = collections.OrderedDict()
+        self._inflight = SingleFlight()
+
+    async def get(self, key: str, width: int, fmt: str) -> bytes:
+        cache_key = (key, width, fmt)
+        item = self._items.get(cache_key)
+        if item is not None:
+            created, data = item
+            if time.monotonic() - created < self.ttl:
+                self._items.move_to_end(cache_key)
+                return data
+            self._drop(cache_key)
+        return await self._inflight.do(cache_key, lambda: self._generate(cache_key))
+
+    async def _generate(self, cache_key: Tuple[str, int, str]) -> bytes:
+        data = await self.render(*cache_key)
+        self._put(cache_key, data)
+        return data
+
+    def _put(self, cache_key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        self._drop(cache_key)
+        self._items[cache_key] = (time.monotonic(), data)
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._items))
+            self._drop(oldest)
+
+    def _drop(self, cache_key):
+        item = self._items.pop(cache_key, None)
+        if item is not None:
+            self.total_bytes -= len(item[1])